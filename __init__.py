@@ -33,11 +33,15 @@ def post_init_hook(env):
                     'show_total': True,
                     'total_template': '--------\nTOTAL                kr {total}\n\n{payment_method}          {amount}\n\nBYTTEPENGE\n                     kr {change}',
                     'show_tax': True,
-                    'tax_template': 'Moms    Beløb    Basis      I alt\n25%     {tax_amount} kr  {tax_base} kr  {total} kr',
+                    'tax_template': 'Moms    Beløb    Basis      I alt\n{tax_lines}',
+                    'tax_line_template': '{tax_rate}     {tax_amount} kr  {tax_base} kr  {total} kr',
                     'show_customer': True,
                     'customer_template': 'Kunde: {customer_name}',
                     'show_footer': True,
                     'footer_template': 'Tak for dit køb!\n\n{website_line}\n\nUnik kode: {unique_code}\nOrdre: {order_name}\n{order_datetime}'
                 }
             ])
+
+    # Orders created before the installation get a receipt link token of their own
+    env['pos.order']._init_sms_receipt_tokens()
 from . import controllers
\ No newline at end of file
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 {
     'name': 'POS SMS Receipt',
-    'version': '17.0.1.0.0',
+    'version': '17.0.1.1.0',
     'category': 'Point of Sale',
     "license": "AGPL-3",
     'summary': 'Send POS receipts via SMS with customizable templates.',
@@ -18,6 +18,8 @@ Key Features:
 - Customizable SMS templates
 - SMS sending status tracking
 - Backend resend functionality
+- Queued background dispatch of SMS receipts
+- Offline SMS receipt outbox in the POS
     """,
     'author': 'Walther Barnett',
     'website': 'https://github.com/waltherB/odoo-sms-pos-receipt',
@@ -36,13 +38,16 @@ Key Features:
         'data/sms_template_data.xml',
         'data/sms_receipt_template_data.xml',
         'data/setup_sms_accounts.xml',
+        'data/ir_cron_data.xml',
         'views/pos_config_views.xml',
         'views/pos_order_views.xml',
         'views/sms_template_views.xml',
         'views/sms_receipt_template_views.xml',
+        'views/pos_sms_receipt_dispatch_views.xml',
     ],
     'assets': {
         'point_of_sale._assets_pos': [
+            'odoo-sms-pos-receipt/static/src/js/sms_outbox_service.js',
             'odoo-sms-pos-receipt/static/src/js/Screens/ReceiptScreen/ReceiptScreen.js',
             'odoo-sms-pos-receipt/static/src/xml/Screens/ReceiptScreen/ReceiptScreen.xml',
         ],
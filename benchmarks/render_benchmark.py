@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmark of the compiled SMS receipt renderer.
+
+Renders synthetic orders with the default complete Danish template, once the
+way ``_render_custom_sms_receipt`` used to do it (``str.format`` of every
+section template for every order) and once with the compiled renderer.
+The legacy timing excludes the template searches and ORM reads the old path
+also did per order, so the real gain in Odoo is larger than measured here.
+
+Runs without Odoo:
+
+    python benchmarks/render_benchmark.py --orders 10000 --items 5
+"""
+import argparse
+import importlib.util
+import os
+import time
+
+RENDERER_PATH = os.path.join(os.path.dirname(__file__), '..', 'tools', 'receipt_renderer.py')
+
+TEMPLATE = {
+    'company_info': '{company_name}\n{phone_line}\n{vat_line}\n{email_line}\n{website_line}',
+    'separator': '--------------------------------',
+    'order_info': '{served_by_line}\nOrdre: {order_name}\nDato: {order_date}',
+    'items': '{qty}x {product_name} = {price} kr',
+    'total': '--------\nTOTAL                kr {total}\n\n{payment_method}          {amount}\n\nBYTTEPENGE\n                     kr {change}',
+    'tax': 'Moms    Beløb    Basis      I alt\n25%     {tax_amount} kr  {tax_base} kr  {total} kr',
+    'customer': 'Kunde: {customer_name}',
+    'footer': 'Tak for dit køb!\n\n{website_line}\n\nUnik kode: {unique_code}\nOrdre: {order_name}\n{order_datetime}',
+}
+
+
+def load_renderer():
+    spec = importlib.util.spec_from_file_location('receipt_renderer', RENDERER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_orders(count, items):
+    """Build the per-section values of ``count`` orders with ``items`` lines each."""
+    orders = []
+    for index in range(count):
+        name = f"Shop/{index:06d}"
+        orders.append({
+            'company_info': {
+                'company_name': "Butik ApS",
+                'phone_line': "Telefon: +45 12 34 56 78",
+                'vat_line': "CVR: 12345678",
+                'email_line': "info@butik.dk",
+                'website_line': "",
+            },
+            'separator': {},
+            'order_info': {
+                'served_by_line': "Betjent af Jane Smith",
+                'order_name': name,
+                'order_date': "29-07-2025 08:30",
+            },
+            'items': [{
+                'product_name': f"Product {line}",
+                'qty': "2",
+                'price': f"{10.0 * line:.2f}",
+            } for line in range(items)],
+            'total': {'total': "75.00", 'payment_method': "Kontant", 'amount': "80.00", 'change': "5.00"},
+            'tax': {'tax_amount': "15.00", 'tax_base': "60.00", 'total': "75.00"},
+            'customer': {'customer_name': "Jane Smith"},
+            'footer': {
+                'website_line': "Besøg butik.dk for mere information",
+                'unique_code': name,
+                'order_name': name,
+                'order_datetime': "29-07-2025 08:30:15",
+            },
+        })
+    return orders
+
+
+def render_legacy(template, values):
+    """Render like the former per-order implementation did."""
+    body_parts = []
+    for name in ('company_info', 'separator', 'order_info'):
+        text = template[name].format(**values[name])
+        if name != 'separator':
+            text = '\n'.join(line for line in text.split('\n') if line.strip())
+        body_parts.append(text)
+    items_text = ""
+    for line_values in values['items']:
+        items_text += template['items'].format(**line_values) + "\n"
+    if items_text:
+        body_parts.append(items_text.rstrip())
+    for name in ('total', 'tax', 'customer'):
+        body_parts.append(template[name].format(**values[name]))
+    footer = template['footer'].format(**values['footer'])
+    body_parts.append('\n'.join(line for line in footer.split('\n') if line.strip()))
+    return '\n\n'.join(part for part in body_parts if part.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--items', type=int, default=5)
+    args = parser.parse_args()
+
+    receipt_renderer = load_renderer()
+    orders = synthetic_orders(args.orders, args.items)
+
+    start = time.perf_counter()
+    legacy_bodies = [render_legacy(TEMPLATE, values) for values in orders]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    renderer = receipt_renderer.ReceiptRenderer(TEMPLATE)
+    compiled_bodies = [renderer.render(values) for values in orders]
+    compiled_time = time.perf_counter() - start
+
+    assert legacy_bodies == compiled_bodies, "Compiled renderer output differs from legacy output"
+    print(f"{args.orders} orders x {args.items} items")
+    print(f"legacy str.format: {legacy_time * 1000:8.1f} ms ({legacy_time / args.orders * 1e6:.1f} us/order)")
+    print(f"compiled renderer: {compiled_time * 1000:8.1f} ms ({compiled_time / args.orders * 1e6:.1f} us/order)")
+    print(f"speedup:           {legacy_time / compiled_time:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
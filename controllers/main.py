@@ -1,11 +1,32 @@
 # -*- coding: utf-8 -*-
-from odoo import http
+from odoo import api, fields, http
 from odoo.http import request
+from odoo.tools import consteq, html_escape
+from datetime import timedelta
+from werkzeug.exceptions import BadRequest
+import csv
+import io
 import json
 import logging
 
+from ..models.pos_sms_receipt_dispatch import EXPORT_BATCH_SIZE, EXPORT_COLUMNS
+
 _logger = logging.getLogger(__name__)
 
+RECEIPT_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8"/>
+    <meta name="viewport" content="width=device-width, initial-scale=1"/>
+    <meta name="robots" content="noindex"/>
+    <title>%(title)s</title>
+</head>
+<body style="font-family: monospace; max-width: 40em; margin: 1em auto; padding: 0 1em;">
+    <pre style="white-space: pre-wrap;">%(body)s</pre>
+</body>
+</html>
+"""
+
 
 class PosSmsReceiptController(http.Controller):
 
@@ -26,6 +47,111 @@ class PosSmsReceiptController(http.Controller):
             _logger.error("Error in SMS controller: %s", str(e))
             return {'error': str(e)}
 
+    @http.route('/pos_sms_receipt/r/<string:token>', type='http', auth='public', methods=['GET'])
+    def receipt_link(self, token, **kwargs):
+        """
+        Serve the full receipt of a receipt link sent by SMS
+        """
+        order = request.env['pos.order']._get_order_by_sms_receipt_token(token)
+        if not order:
+            return request.not_found()
+
+        body, etag = order._get_sms_receipt_web_body()
+        # The receipt does not change, but the link expires
+        max_age = min(3600, int((order.sms_receipt_token_expiry - fields.Datetime.now()).total_seconds()))
+        headers = [
+            ('ETag', '"%s"' % etag),
+            ('Cache-Control', 'private, max-age=%d' % max(max_age, 0)),
+            ('X-Robots-Tag', 'noindex'),
+        ]
+        if request.httprequest.if_none_match.contains(etag):
+            return request.make_response('', headers=headers, status=304)
+
+        html = RECEIPT_PAGE % {
+            'title': html_escape('%s - %s' % (order.company_id.name, order.name)),
+            'body': html_escape(body),
+        }
+        return request.make_response(html, headers=headers + [('Content-Type', 'text/html; charset=utf-8')])
+
+    @http.route('/pos_sms_receipt/metrics', type='http', auth='public', methods=['GET'])
+    def metrics(self, token=None, **kwargs):
+        """
+        Export the SMS receipt dispatch metrics of all workers in the Prometheus text format.
+        Open to POS managers, or to scrapers passing the token set in the
+        ``pos_sms_receipt.metrics_token`` system parameter.
+        """
+        expected_token = request.env['ir.config_parameter'].sudo().get_param('pos_sms_receipt.metrics_token')
+        bearer = request.httprequest.headers.get('Authorization', '')
+        if bearer.startswith('Bearer '):
+            token = bearer[len('Bearer '):]
+        allowed = (
+            (expected_token and token and consteq(token, expected_token))
+            or request.env.user.has_group('point_of_sale.group_pos_manager')
+        )
+        if not allowed:
+            return request.not_found()
+        metrics = request.env['pos.sms.receipt.metric'].sudo()._render_prometheus()
+        return request.make_response(metrics, headers=[
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+            ('Cache-Control', 'no-store'),
+        ])
+
+    @http.route('/pos_sms_receipt/export', type='http', auth='user', methods=['GET'])
+    def export_receipts(self, date_from, date_to, state='sent', format='csv', **kwargs):
+        """
+        Stream the SMS receipts of a period as CSV or JSON Lines, for auditing.
+        Sent receipts are filtered on their sending date, the others on their
+        request date; both dates are included. POS managers only.
+        """
+        if not request.env.user.has_group('point_of_sale.group_pos_manager'):
+            return request.not_found()
+        try:
+            date_from = fields.Date.to_date(date_from)
+            date_to = fields.Date.to_date(date_to)
+        except ValueError:
+            raise BadRequest("date_from and date_to must be dates formatted as YYYY-MM-DD")
+        if format not in ('csv', 'jsonl') or not date_from or not date_to:
+            raise BadRequest("Expected date_from, date_to and a csv or jsonl format")
+
+        date_field = 'sent_at' if state == 'sent' else 'create_date'
+        domain = [
+            (date_field, '>=', fields.Datetime.to_string(date_from)),
+            (date_field, '<', fields.Datetime.to_string(date_to + timedelta(days=1))),
+        ]
+        if state != 'all':
+            domain.append(('state', '=', state))
+
+        # The request cursor is closed once the response starts streaming,
+        # the rows are read with a cursor of their own
+        registry, uid, context = request.env.registry, request.env.uid, dict(request.env.context)
+
+        def generate():
+            with registry.cursor() as cr:
+                env = api.Environment(cr, uid, context)
+                rows = env['pos.sms.receipt.dispatch']._export_rows(domain)
+                if format == 'jsonl':
+                    for row in rows:
+                        yield (json.dumps(row, ensure_ascii=False) + '\n').encode()
+                    return
+                buffer = io.StringIO()
+                writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+                writer.writeheader()
+                for index, row in enumerate(rows, 1):
+                    writer.writerow(row)
+                    if index % EXPORT_BATCH_SIZE == 0:
+                        yield buffer.getvalue().encode()
+                        buffer.seek(0)
+                        buffer.truncate()
+                yield buffer.getvalue().encode()
+
+        filename = 'sms_receipts_%s_%s.%s' % (date_from, date_to, format)
+        content_type = 'application/x-ndjson' if format == 'jsonl' else 'text/csv; charset=utf-8'
+        return request.make_response(generate(), headers=[
+            ('Content-Type', content_type),
+            ('Content-Disposition', http.content_disposition(filename)),
+            ('Cache-Control', 'no-store'),
+        ])
+
     @http.route('/pos_sms_receipt/test', type='http', auth='public')
     def test_controller(self):
         """
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Log the SMS receipts sent before the dispatch log as dispatches.
+
+The SMS receipt status of orders used to be stored on the orders, it is
+now computed from their dispatches. Each order sent, or whose last send
+failed, gets one sent or failed dispatch, so it keeps its status and is
+not sent again by the bulk send. The columns of the old status are dropped.
+
+Receipt link tokens are now given to orders on their creation, the orders
+created before get theirs.
+
+The tax section used to print a single hardcoded "25%" line. It now lists
+one line per tax of the order, rendered with the tax line template: the
+old line becomes the tax line template, its rate replaced by {tax_rate}.
+"""
+import logging
+import re
+
+from psycopg2.extras import Json
+
+from odoo import api, SUPERUSER_ID
+from odoo.tools.sql import column_exists
+
+_logger = logging.getLogger(__name__)
+
+# The hardcoded tax line of the old default templates, in any language
+_OLD_TAX_LINE_RE = re.compile(r'^25%(?=\s).*\{tax_amount\}.*$', re.MULTILINE)
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    api.Environment(cr, SUPERUSER_ID, {})['pos.order']._init_sms_receipt_tokens()
+    _migrate_tax_lines(cr)
+    if not column_exists(cr, 'pos_order', 'is_sms_receipt_sent'):
+        return
+    cr.execute("""
+        INSERT INTO pos_sms_receipt_dispatch (
+            order_id, config_id, gateway_id, phone, state, error, attempt_count, sent_at,
+            create_uid, create_date, write_uid, write_date
+        )
+        SELECT o.id, s.config_id, c.sms_gateway_id,
+               COALESCE(o.sms_phone_e164, o.phone_for_sms_receipt, '-'),
+               CASE WHEN o.is_sms_receipt_sent THEN 'sent' ELSE 'failed' END,
+               CASE WHEN o.is_sms_receipt_sent THEN NULL ELSE o.sms_receipt_error END,
+               1,
+               CASE WHEN o.is_sms_receipt_sent THEN o.write_date END,
+               o.write_uid, o.write_date, o.write_uid, o.write_date
+          FROM pos_order o
+          LEFT JOIN pos_session s ON s.id = o.session_id
+          LEFT JOIN pos_config c ON c.id = s.config_id
+         WHERE (o.is_sms_receipt_sent OR o.sms_receipt_error IS NOT NULL)
+           AND NOT EXISTS (SELECT 1 FROM pos_sms_receipt_dispatch d WHERE d.order_id = o.id)
+    """)
+    _logger.info("Logged the SMS receipts of %s orders as dispatches", cr.rowcount)
+    # The errors hold the phones as typed, the redaction of the dispatches covers them now
+    cr.execute("ALTER TABLE pos_order DROP COLUMN is_sms_receipt_sent, DROP COLUMN sms_receipt_error")
+
+
+def _migrate_tax_lines(cr):
+    cr.execute("""
+        SELECT id, tax_template, tax_line_template
+          FROM sms_receipt_template
+         WHERE tax_template IS NOT NULL
+    """)
+    migrated = 0
+    for template_id, tax_template, tax_line_template in cr.fetchall():
+        tax_line_template = dict(tax_line_template or {})
+        changed = False
+        for lang, text in tax_template.items():
+            match = _OLD_TAX_LINE_RE.search(text or '')
+            if not match:
+                continue
+            tax_template[lang] = text[:match.start()] + '{tax_lines}' + text[match.end():]
+            tax_line_template[lang] = '{tax_rate}' + match.group(0)[len('25%'):]
+            changed = True
+        if changed:
+            cr.execute("""
+                UPDATE sms_receipt_template
+                   SET tax_template = %s, tax_line_template = %s
+                 WHERE id = %s
+            """, [Json(tax_template), Json(tax_line_template), template_id])
+            migrated += 1
+    _logger.info("Moved the tax line of %s SMS receipt templates to the tax line template", migrated)
@@ -2,4 +2,8 @@
 from . import pos_order
 from . import pos_config
 from . import iap_account
+from . import res_partner
 from . import sms_receipt_template
+from . import pos_sms_receipt_dispatch
+from . import pos_sms_gateway_state
+from . import pos_sms_receipt_metric
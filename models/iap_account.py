@@ -8,7 +8,20 @@ _logger = logging.getLogger(__name__)
 class IapAccount(models.Model):
     _inherit = 'iap.account'
 
+    @api.model
+    def get(self, service_name, force_create=True):
+        """Use the SMS gateway account selected on the POS when sending receipts.
 
+        The receipt dispatch sets ``sms_iap_account_id`` in the context so the
+        SMS API contacts the account configured on ``pos.config`` instead of
+        the default one.
+        """
+        account_id = self.env.context.get('sms_iap_account_id')
+        if service_name == 'sms' and account_id:
+            account = self.sudo().browse(account_id).exists()
+            if account:
+                return account
+        return super(IapAccount, self).get(service_name, force_create=force_create)
 
     @api.model
     def name_search(self, name='', args=None, operator='ilike', limit=100):
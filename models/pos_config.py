@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from odoo import api, fields, models
 
+from .pos_sms_gateway_state import DEFAULT_CIRCUIT_COOLDOWN
+
 
 class PosConfig(models.Model):
     _inherit = 'pos.config'
@@ -18,16 +20,120 @@ class PosConfig(models.Model):
         domain=[('service_name', '=', 'sms')],
         help="Select the SMS gateway account to use for sending receipts. "
              "Choose from configured SMS gateway accounts by name. "
+             "Receipts are submitted in batches per gateway account. "
              "If not set, the default SMS gateway will be used."
     )
 
+    sms_dispatch_mode = fields.Selection(
+        selection=[
+            ('immediate', 'Immediate'),
+            ('queued', 'Queued'),
+        ],
+        string="SMS Dispatch Mode",
+        default='immediate',
+        required=True,
+        help="Immediate: the receipt is sent while the cashier waits. "
+             "Queued: the receipt is queued and sent in the background, "
+             "so the receipt screen does not wait on the SMS gateway."
+    )
+
+    sms_auto_send = fields.Boolean(
+        string="Auto-send SMS Receipts",
+        default=False,
+        help="Queue the SMS receipt of every paid order synced with a phone "
+             "number, in one batch per sync, without a separate request per "
+             "order from the POS."
+    )
+
+    sms_prerender = fields.Boolean(
+        string="Pre-render SMS Receipts",
+        default=False,
+        help="Render the SMS receipt of orders synced with a phone number "
+             "right after the sync, so sending it only dispatches the stored "
+             "body. The stored body is the one sent, even if the template "
+             "changes afterwards."
+    )
+
+    sms_dedup_window = fields.Integer(
+        string="SMS Deduplication Window (minutes)",
+        default=10,
+        help="Requests to send the same receipt to the same phone within this "
+             "many minutes return the status of the first request instead of "
+             "sending another SMS. Set to 0 to disable."
+    )
+
+    sms_max_attempts = fields.Integer(
+        string="SMS Max Attempts",
+        default=3,
+        help="Number of times an SMS receipt is sent before it is marked as "
+             "failed. Failed attempts are retried in the background with an "
+             "increasing delay. Set to 1 to disable retries."
+    )
+
+    sms_rate_limit = fields.Integer(
+        string="SMS Rate Limit (per minute)",
+        default=0,
+        help="Maximum number of SMS receipts sent per minute through the "
+             "gateway account, shared by all Points of Sale using it. Receipts "
+             "over the limit are queued. Set to 0 for no limit."
+    )
+
+    sms_circuit_threshold = fields.Integer(
+        string="SMS Circuit Breaker Threshold",
+        default=5,
+        help="Number of consecutive failed gateway calls after which receipts "
+             "are queued instead of sent, until the cooldown has passed. "
+             "Set to 0 to disable the circuit breaker."
+    )
+
+    sms_circuit_cooldown = fields.Integer(
+        string="SMS Circuit Breaker Cooldown (minutes)",
+        default=5,
+        help="Minutes the gateway is left alone after the circuit breaker "
+             "opened, before a trial send is made."
+    )
+
+    sms_gateway_circuit_state = fields.Selection(
+        selection=[
+            ('closed', 'Closed'),
+            ('open', 'Open'),
+            ('half_open', 'Half Open'),
+        ],
+        string="SMS Gateway Circuit",
+        compute='_compute_sms_gateway_circuit_state',
+        help="Current circuit breaker state of the SMS gateway account."
+    )
+
+    @api.depends('sms_gateway_id')
+    def _compute_sms_gateway_circuit_state(self):
+        states = self.env['pos.sms.gateway.state'].sudo().search([
+            ('gateway_id', 'in', self.sms_gateway_id.ids + [False]),
+        ])
+        circuit_by_gateway = {state.gateway_id.id: state.circuit_state for state in states}
+        for config in self:
+            config.sms_gateway_circuit_state = circuit_by_gateway.get(config.sms_gateway_id.id, 'closed')
+
+    def _get_sms_gateway_policy(self):
+        """Get the rate limiter and circuit breaker policy of Points of Sale sharing a gateway.
+
+        The strictest settings of the Points of Sale win.
+        """
+        rate_limits = [config.sms_rate_limit for config in self if config.sms_rate_limit > 0]
+        thresholds = [config.sms_circuit_threshold for config in self if config.sms_circuit_threshold > 0]
+        cooldowns = [config.sms_circuit_cooldown for config in self if config.sms_circuit_cooldown > 0]
+        return {
+            'rate_limit': min(rate_limits, default=0),
+            'circuit_threshold': min(thresholds, default=0),
+            'circuit_cooldown': max(cooldowns, default=DEFAULT_CIRCUIT_COOLDOWN),
+        }
+
     def _get_fields_for_pos_config(self):
         """
         Returns the list of fields of pos.config that needs to be loaded
         by the POS UI.
         """
         fields = super()._get_fields_for_pos_config()
-        fields.extend(['enable_sms_receipt', 'sms_gateway_id'])
+        fields.extend(['enable_sms_receipt', 'sms_gateway_id', 'sms_dispatch_mode'])
         return fields
 
     @api.model
@@ -1,12 +1,25 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
-from datetime import timedelta
+from odoo.osv import expression
+from odoo.tools import split_every
+from datetime import datetime, timedelta
+import hashlib
 import logging
 import re
+import secrets
+
+from ..tools.metrics import dispatch_metrics
+from ..tools.phone_numbers import normalize_e164
+from ..tools.receipt_renderer import compile_template
+from ..tools.sms_segments import segment_count
+from .pos_sms_receipt_dispatch import WAITING_DISPATCH_STATES
 
 _logger = logging.getLogger(__name__)
 
+# Orders given a receipt link token per query when tokens are created on install or upgrade
+TOKEN_BATCH_SIZE = 10000
+
 
 class PosOrder(models.Model):
     _inherit = 'pos.order'
@@ -17,20 +30,208 @@ class PosOrder(models.Model):
         readonly=True,
         copy=False
     )
+    sms_phone_e164 = fields.Char(
+        string="SMS Receipt Phone (E.164)",
+        compute='_compute_sms_phone_e164',
+        store=True,
+        index=True,
+        copy=False,
+        help="Phone given at the POS for the SMS receipt, in E.164 format. "
+             "Without it, the receipt goes to the customer's mobile or phone, "
+             "read when sending."
+    )
+    # The SMS receipt summary is computed from the dispatch log of the
+    # order: sending a receipt never writes the order itself
     is_sms_receipt_sent = fields.Boolean(
         string="SMS Receipt Sent",
-        default=False,
-        readonly=True,
-        copy=False,
+        compute='_compute_sms_receipt_summary',
+        search='_search_is_sms_receipt_sent',
         help="Indicates if an SMS receipt has been sent for this order."
     )
     sms_receipt_error = fields.Text(
         string="SMS Receipt Error",
+        compute='_compute_sms_receipt_summary',
+        help="Error message if SMS sending failed."
+    )
+    sms_receipt_body = fields.Text(
+        string="SMS Receipt Body",
         readonly=True,
         copy=False,
-        help="Error message if SMS sending failed."
+        prefetch=False,
+        help="SMS receipt rendered when the order was synced, sent as is."
+    )
+    sms_receipt_body_lang = fields.Char(
+        string="SMS Receipt Body Language",
+        readonly=True,
+        copy=False
+    )
+    sms_receipt_segments = fields.Integer(
+        string="SMS Receipt Segments",
+        compute='_compute_sms_receipt_summary',
+        help="Number of billed SMS segments of the last sent or pre-rendered SMS receipt."
+    )
+    sms_receipt_state = fields.Selection(
+        selection=[
+            ('none', 'Not Sent'),
+            ('pending', 'Pending'),
+            ('sent', 'Sent'),
+            ('failed', 'Failed'),
+        ],
+        string="SMS Receipt Status",
+        compute='_compute_sms_receipt_summary',
+        search='_search_sms_receipt_state',
+        help="Pending while a dispatch waits to be sent, then Sent once a "
+             "receipt was sent, Failed if every dispatch failed."
+    )
+    sms_receipt_sent_at = fields.Datetime(
+        string="SMS Receipt Sent On",
+        compute='_compute_sms_receipt_summary',
+        search='_search_sms_receipt_sent_at'
+    )
+    sms_receipt_sms_id = fields.Many2one(
+        'sms.sms',
+        string="SMS Receipt SMS",
+        compute='_compute_sms_receipt_summary'
+    )
+    sms_receipt_gateway_id = fields.Many2one(
+        'iap.account',
+        string="SMS Receipt Gateway Account",
+        compute='_compute_sms_receipt_summary'
+    )
+    sms_receipt_token = fields.Char(
+        string="SMS Receipt Link Token",
+        readonly=True,
+        copy=False,
+        index=True,
+        default=lambda self: secrets.token_urlsafe(16),
+        groups='point_of_sale.group_pos_manager',
+        help="Random and unguessable, given to the order on its creation so "
+             "sending a receipt link never writes the order."
+    )
+    sms_receipt_token_expiry = fields.Datetime(
+        string="SMS Receipt Link Expiry",
+        compute='_compute_sms_receipt_token_expiry',
+        groups='point_of_sale.group_pos_manager',
+        help="The receipt link stays valid for the link validity of the "
+             "template after the receipt was last sent."
+    )
+    sms_receipt_dispatch_ids = fields.One2many(
+        'pos.sms.receipt.dispatch',
+        'order_id',
+        string="SMS Receipt Dispatches",
+        readonly=True,
+        copy=False
     )
 
+    @api.depends(
+        'sms_receipt_dispatch_ids.state', 'sms_receipt_dispatch_ids.error',
+        'sms_receipt_dispatch_ids.sent_at', 'sms_receipt_dispatch_ids.segments',
+        'sms_receipt_body',
+    )
+    def _compute_sms_receipt_summary(self):
+        for order in self:
+            # Dispatches are ordered from the latest
+            dispatches = order.sms_receipt_dispatch_ids
+            waiting = dispatches.filtered(lambda d: d.state in WAITING_DISPATCH_STATES)
+            sent = dispatches.filtered(lambda d: d.state == 'sent').sorted(
+                lambda d: d.sent_at or datetime.min, reverse=True
+            )[:1]
+            last = dispatches[:1]
+            if waiting:
+                order.sms_receipt_state = 'pending'
+            elif sent:
+                order.sms_receipt_state = 'sent'
+            else:
+                order.sms_receipt_state = 'failed' if dispatches else 'none'
+            order.is_sms_receipt_sent = bool(sent)
+            order.sms_receipt_error = last.error if last.state == 'failed' else False
+            order.sms_receipt_sent_at = sent.sent_at
+            order.sms_receipt_sms_id = (sent or last).sms_id
+            order.sms_receipt_gateway_id = (sent or last).gateway_id
+            if sent:
+                order.sms_receipt_segments = sent.segments
+            elif order.sms_receipt_body:
+                order.sms_receipt_segments = segment_count(order.sms_receipt_body)[1]
+            else:
+                order.sms_receipt_segments = 0
+
+    @api.depends('sms_receipt_dispatch_ids.state', 'sms_receipt_dispatch_ids.sent_at')
+    @api.depends_context('lang')
+    def _compute_sms_receipt_token_expiry(self):
+        user_lang = self.env.context.get('lang', 'da_DK')
+        validity_days = {}
+        for order in self:
+            if not order.sms_receipt_sent_at:
+                order.sms_receipt_token_expiry = False
+                continue
+            if order.company_id.id not in validity_days:
+                validity_days[order.company_id.id] = self.env['sms.receipt.template'].get_default_template(
+                    company_id=order.company_id.id,
+                    language=user_lang
+                ).link_validity_days
+            order.sms_receipt_token_expiry = order.sms_receipt_sent_at + timedelta(
+                days=validity_days[order.company_id.id]
+            )
+
+    def _search_sms_receipt_state(self, operator, value):
+        if operator not in ('=', '!=', 'in', 'not in'):
+            raise UserError(_("Unsupported search on the SMS receipt status."))
+        values = [value] if operator in ('=', '!=') else value
+        state_domains = {
+            'none': [('sms_receipt_dispatch_ids', '=', False)],
+            'pending': [('sms_receipt_dispatch_ids', 'any', [('state', 'in', WAITING_DISPATCH_STATES)])],
+            'sent': [
+                ('sms_receipt_dispatch_ids', 'any', [('state', '=', 'sent')]),
+                ('sms_receipt_dispatch_ids', 'not any', [('state', 'in', WAITING_DISPATCH_STATES)]),
+            ],
+            'failed': [
+                ('sms_receipt_dispatch_ids', 'any', [('state', '=', 'failed')]),
+                ('sms_receipt_dispatch_ids', 'not any', [('state', 'in', WAITING_DISPATCH_STATES + ('sent',))]),
+            ],
+        }
+        domain = expression.OR([state_domains[state] for state in values if state in state_domains])
+        if operator in ('!=', 'not in'):
+            return ['!'] + expression.normalize_domain(domain)
+        return domain
+
+    def _search_is_sms_receipt_sent(self, operator, value):
+        if operator not in ('=', '!='):
+            raise UserError(_("Unsupported search on the SMS receipt status."))
+        sent = (operator == '=') == bool(value)
+        return [('sms_receipt_dispatch_ids', 'any' if sent else 'not any', [('state', '=', 'sent')])]
+
+    def _search_sms_receipt_sent_at(self, operator, value):
+        # Matches the computed value: the sending time of the latest sent dispatch
+        sent = [('state', '=', 'sent')]
+        if operator in ('=', '!=') and not value:
+            return [('sms_receipt_dispatch_ids', 'not any' if operator == '=' else 'any', sent)]
+        if operator in ('>', '>='):
+            return [('sms_receipt_dispatch_ids', 'any', sent + [('sent_at', operator, value)])]
+        if operator not in ('<', '<=', '=', '!='):
+            raise UserError(_("Unsupported search on the SMS receipt status."))
+        # No receipt sent after the value either
+        domain = [
+            ('sms_receipt_dispatch_ids', 'any', sent + [('sent_at', '=' if operator == '!=' else operator, value)]),
+            ('sms_receipt_dispatch_ids', 'not any', sent + [('sent_at', '>=' if operator == '<' else '>', value)]),
+        ]
+        if operator == '!=':
+            return ['!'] + expression.normalize_domain(domain)
+        return domain
+
+    @api.depends('phone_for_sms_receipt')
+    def _compute_sms_phone_e164(self):
+        # Frozen with the phone given at the POS: editing the customer or the
+        # company country does not rewrite past orders
+        for order in self:
+            order.sms_phone_e164 = order._clean_phone_number(order.phone_for_sms_receipt)
+
+    def _get_sms_receipt_e164(self):
+        """Get the E.164 phone to send the receipt to: the one given at the POS, else the customer's."""
+        self.ensure_one()
+        if self.phone_for_sms_receipt:
+            return self.sms_phone_e164
+        return self.partner_id.sms_phone_e164
+
     @api.model
     def _order_fields(self, ui_order):
         """Map UI order fields to backend order fields."""
@@ -40,22 +241,192 @@ class PosOrder(models.Model):
         )
         return fields_return
 
+    @api.model
+    def create_from_ui(self, orders, draft=False):
+        """Queue or pre-render the SMS receipts of the synced orders."""
+        order_ids = super().create_from_ui(orders, draft=draft)
+        if not draft:
+            synced = self.browse([order['id'] for order in order_ids])
+            if not self.env.context.get('sms_receipt_no_auto_send'):
+                synced -= synced._auto_send_sms_receipts()
+            synced._schedule_sms_receipt_prerender()
+        return order_ids
+
+    def _auto_send_sms_receipts(self):
+        """Queue the SMS receipts of the orders synced with a phone number, in one batch.
+
+        Only orders of Points of Sale auto-sending their receipts and without
+        any dispatch yet are queued, so syncing an order again sends nothing.
+        Nothing is rendered here, the queue renders and sends the receipts;
+        a failure only leaves the receipts unsent, the sync goes through.
+
+        :return: the orders whose receipt was queued
+        """
+        orders = self.filtered(
+            lambda o: o.config_id.enable_sms_receipt and o.config_id.sms_auto_send
+            and o.phone_for_sms_receipt and o.state not in ('draft', 'cancel')
+            and not o.sms_receipt_dispatch_ids
+        )
+        if not orders:
+            return orders
+        invalid = orders.filtered(lambda o: not o.sms_phone_e164)
+        try:
+            with self.env.cr.savepoint():
+                Dispatch = self.env['pos.sms.receipt.dispatch']
+                Dispatch._log_rejected([{
+                    'order_id': order.id,
+                    'phone': order.phone_for_sms_receipt,
+                    'error': _("Invalid phone number format."),
+                } for order in invalid])
+                Dispatch._enqueue([{
+                    'order_id': order.id,
+                    'phone': order.sms_phone_e164,
+                } for order in orders - invalid])
+        except Exception:
+            _logger.exception("Failed to queue the SMS receipts of orders %s", orders.ids)
+            return self.browse()
+        return orders - invalid
+
+    def _schedule_sms_receipt_prerender(self):
+        """Render the SMS receipts of the orders after the commit, in a transaction of their own.
+
+        Only paid orders with a phone number of Points of Sale pre-rendering
+        their receipts are rendered; the sync itself never waits on it.
+        """
+        orders = self.filtered(
+            lambda o: o.config_id.enable_sms_receipt and o.config_id.sms_prerender
+            and o.phone_for_sms_receipt and o.state not in ('draft', 'cancel')
+        )
+        if not orders:
+            return
+        order_ids, uid, context = orders.ids, self.env.uid, dict(self.env.context)
+        registry = self.env.registry
+
+        @self.env.cr.postcommit.add
+        def prerender():
+            try:
+                with registry.cursor() as cr:
+                    env = api.Environment(cr, uid, context)
+                    env['pos.order'].browse(order_ids).exists()._prerender_sms_receipts()
+            except Exception:
+                _logger.exception("Failed to pre-render SMS receipts of orders %s", order_ids)
+
+    def _prerender_sms_receipts(self):
+        """Store the rendered SMS receipts, so sending them only dispatches a ready body."""
+        lang = self.env.context.get('lang', 'da_DK')
+        bodies = self.env['pos.sms.receipt.dispatch']._render_order_bodies(self, lang)
+        for order in self:
+            body = bodies.get(order.id)
+            if body:
+                order.write({
+                    'sms_receipt_body': body,
+                    'sms_receipt_body_lang': lang,
+                })
+
     def action_send_sms_receipt_rpc(self, phone_number=None):
         """RPC method called from POS frontend to send SMS receipt."""
         return self.action_send_sms_receipt(phone_number)
 
     @api.model
     def create_from_ui_with_sms(self, orders, phone_number=None):
-        """Create order from UI data and prepare for SMS sending."""
-        # Ensure phone number is included in order data
-        if phone_number and orders:
-            for order_data in orders:
-                if isinstance(order_data, dict):
-                    order_data['phone_for_sms_receipt'] = phone_number
-        
-        # Use the standard create_from_ui method
-        result = self.create_from_ui(orders)
-        return result
+        """Sync orders from the UI and send their SMS receipt in a single call.
+
+        Safe to call again with the same orders: orders already synced are
+        looked up by their POS reference instead of being created again, and
+        receipts already dispatched to the same phone are not sent twice.
+
+        :return: list of {'id', 'pos_reference', 'sms_status', 'sms_error'}
+        """
+        entries = []
+        for ui_order in orders:
+            ui_order = self._prepare_ui_order_for_sms(ui_order)
+            data = ui_order['data']
+            entries.append({
+                'reference': data['name'],
+                'phone': phone_number or data.get('phone_for_sms_receipt'),
+                'order': ui_order,
+            })
+
+        results = self.send_sms_receipts_from_ui(entries)
+        return [{
+            'id': results[entry['reference']].get('order_id', False),
+            'pos_reference': entry['reference'],
+            'sms_status': results[entry['reference']]['status'],
+            'sms_error': results[entry['reference']].get('error', False),
+        } for entry in entries]
+
+    @api.model
+    def _prepare_ui_order_for_sms(self, ui_order):
+        """Wrap bare exported order data in the format expected by create_from_ui."""
+        if 'data' in ui_order:
+            return ui_order
+        return {'id': ui_order.get('uid'), 'data': ui_order, 'to_invoice': ui_order.get('to_invoice', False)}
+
+    @api.model
+    def send_sms_receipts_from_ui(self, entries):
+        """Sync the orders if needed and send their SMS receipts in one call.
+
+        Orders are looked up by their POS reference. An entry may carry the
+        UI order data (``create_from_ui`` format) of an order not synced yet,
+        which is then created here; entries of unknown orders without data
+        are reported as pending and the POS retries them later. Receipts
+        already queued or sent to the same phone are reported with their
+        current status instead of being sent again.
+
+        :param entries: list of {'reference': order reference, 'phone': phone number,
+                                 'order': optional UI order data}
+        :return: dict {reference: {'status': 'queued'|'sent'|'pending'|'skipped'|'error',
+                                   'order_id': order id, 'dispatch_id': dispatch id,
+                                   'error': message}}
+        """
+        references = [entry['reference'] for entry in entries]
+        orders = self.search([('pos_reference', 'in', references)])
+
+        # Sync the orders sent along that are not known yet
+        known_references = set(orders.mapped('pos_reference'))
+        ui_orders = []
+        for entry in entries:
+            if entry['reference'] not in known_references and entry.get('order'):
+                ui_order = self._prepare_ui_order_for_sms(entry['order'])
+                if entry.get('phone'):
+                    ui_order['data']['phone_for_sms_receipt'] = entry['phone']
+                ui_orders.append(ui_order)
+                known_references.add(entry['reference'])
+        if ui_orders:
+            # The receipts are dispatched below, in the mode of their POS
+            created = self.with_context(sms_receipt_no_auto_send=True).create_from_ui(ui_orders)
+            orders |= self.browse([order['id'] for order in created])
+        orders_by_reference = {order.pos_reference: order for order in orders}
+
+        results = {}
+        rejected_vals = []
+        dispatch_vals = []
+        dispatch_references = []
+        for entry in entries:
+            reference, phone = entry['reference'], entry.get('phone')
+            order = orders_by_reference.get(reference)
+            if not order:
+                results[reference] = {'status': 'pending'}
+                continue
+            if not phone:
+                results[reference] = {'status': 'skipped', 'order_id': order.id}
+                continue
+            cleaned_phone = order._clean_phone_number(phone)
+            if not cleaned_phone:
+                error_msg = _("Invalid phone number format.")
+                results[reference] = {'status': 'error', 'order_id': order.id, 'error': error_msg}
+                rejected_vals.append({'order_id': order.id, 'phone': phone, 'error': error_msg})
+                continue
+            # The phone is kept on the dispatch, the order is not written
+            dispatch_vals.append({'order_id': order.id, 'phone': cleaned_phone})
+            dispatch_references.append(reference)
+
+        # Receipts already dispatched recently are reported, not sent again
+        self.env['pos.sms.receipt.dispatch']._log_rejected(rejected_vals)
+        dispatches = self.env['pos.sms.receipt.dispatch']._dispatch_receipts(dispatch_vals)
+        for reference, dispatch in zip(dispatch_references, dispatches):
+            results[reference] = dispatch._get_ui_status()
+        return results
 
     def action_send_sms_receipt(self, phone_number=None):
         """Send SMS receipt for the order."""
@@ -71,84 +442,42 @@ class PosOrder(models.Model):
         # Clean and validate phone number
         cleaned_phone = self._clean_phone_number(target_phone)
         if not cleaned_phone:
-            error_msg = _("Invalid phone number format: %s") % target_phone
-            self.write({'sms_receipt_error': error_msg})
+            error_msg = _("Invalid phone number format.")
+            self.env['pos.sms.receipt.dispatch']._log_rejected([{
+                'order_id': self.id,
+                'phone': target_phone,
+                'error': error_msg,
+            }])
             return {'error': error_msg}
 
-        # Update phone number if different
-        if phone_number and self.phone_for_sms_receipt != phone_number:
-            self.write({'phone_for_sms_receipt': phone_number})
+        # Queued mode hands the receipt to the dispatch queue, immediate mode
+        # sends it now; a recent identical request returns its dispatch
+        dispatch = self.env['pos.sms.receipt.dispatch']._dispatch_receipts([{
+            'order_id': self.id,
+            'phone': cleaned_phone,
+        }])[0]
 
-        try:
-            # Use template-based SMS receipt generation
-            body = self._render_custom_sms_receipt()
-            
-            _logger.info("Created SMS receipt body using template system")
-
-            # Send SMS using configured gateway
-            self._send_sms_message(cleaned_phone, body)
-
-            # Mark as sent and log success
-            self.write({
-                'is_sms_receipt_sent': True,
-                'sms_receipt_error': False
-            })
-            # Log success (pos.order doesn't support message_post)
-            _logger.info("SMS receipt logged for order %s", self.name)
+        if dispatch.state == 'sent':
             _logger.info(
                 "SMS receipt sent for order %s to %s",
                 self.name, cleaned_phone
             )
             return True
-
-        except Exception as e:
-            error_msg = str(e)
-            
-            # Handle known gatewayapi-sms compatibility issues
-            if ("'iap.account' object attribute '_get_sms_account' is read-only" in error_msg) or \
-               ('_get_sms_account' in error_msg and 'read-only' in error_msg) or \
-               ('failure_type' in error_msg and 'sms_server_error' in error_msg):
-                # These are known compatibility issues but SMS is usually still sent
-                _logger.warning(
-                    "SMS gateway compatibility warning for order %s to %s: %s",
-                    self.name, cleaned_phone, error_msg
-                )
-                
-                # For these specific errors, assume SMS was sent successfully
-                # since the gatewayapi-sms module typically sends despite these errors
-                self.write({
-                    'is_sms_receipt_sent': True,
-                    'sms_receipt_error': False
-                })
-                # Log success (pos.order doesn't support message_post)
-                _logger.info("SMS receipt logged for order %s", self.name)
-                _logger.info(
-                    "SMS receipt marked as sent for order %s to %s (compatibility issue handled)",
-                    self.name, cleaned_phone
-                )
-                return True
-            
-            # For other errors, log and return error
-            self.write({'sms_receipt_error': error_msg})
-            _logger.error(
-                "Failed to send SMS receipt for order %s to %s: %s",
-                self.name, cleaned_phone, error_msg
-            )
-            return {'error': error_msg}
+        if dispatch.state == 'failed':
+            return {'error': dispatch.error}
+        _logger.info(
+            "SMS receipt queued for order %s to %s",
+            self.name, cleaned_phone
+        )
+        return {'queued': True, 'dispatch_id': dispatch.id}
 
     def _clean_phone_number(self, phone):
-        """Clean and validate phone number."""
-        if not phone:
-            return False
-
-        # Remove spaces, dashes, parentheses
-        cleaned = re.sub(r'[\s\-\(\)]', '', phone)
-
-        # Basic validation: should contain only digits and optional + at start
-        if not re.match(r'^\+?[\d]{7,15}$', cleaned):
-            return False
+        """Normalize a phone number to E.164, the order's company country being the default region.
 
-        return cleaned
+        :return: the normalized number, or False if it is not valid
+        """
+        company = self.company_id if len(self) == 1 else self.env.company
+        return normalize_e164(phone, company.country_id.phone_code)
 
     def _get_sms_template(self):
         """Get SMS template for POS receipt."""
@@ -217,78 +546,28 @@ class PosOrder(models.Model):
         }
 
     def _send_sms_message(self, phone, body):
-        """Send SMS message using configured gateway."""
-        try:
-            _logger.info("_send_sms_message called with body: %s", body[:100] + "..." if len(body) > 100 else body)
-            
-            # Create SMS record and send it using the default gateway
-            # Note: Gateway selection is handled by the SMS gateway module configuration
-            sms_vals = {
-                'number': phone,
-                'body': body,
-                'state': 'outgoing',
-            }
-            
-            _logger.info("Creating SMS record with vals: %s", sms_vals)
-            sms_record = self.env['sms.sms'].create(sms_vals)
-            _logger.info("SMS record created with body: %s", sms_record.body[:100] + "..." if len(sms_record.body) > 100 else sms_record.body)
-            
-            try:
-                sms_record._send()
-            except Exception as send_error:
-                # Handle specific SMS gateway errors
-                error_str = str(send_error)
-                if ('failure_type' in error_str and 'sms_server_error' in error_str) or \
-                   ('_get_sms_account' in error_str and 'read-only' in error_str):
-                    # These are known issues with gatewayapi-sms module
-                    # The SMS might have been sent despite the error
-                    _logger.warning(
-                        "SMS gateway compatibility issue for order %s: %s", 
-                        self.name, error_str
-                    )
-                    # Check if the SMS was actually sent by looking at the record state
-                    sms_record.invalidate_cache()
-                    if sms_record.state in ['sent', 'outgoing']:
-                        _logger.info("SMS was sent successfully despite the error")
-                        return  # SMS was sent successfully
-                    else:
-                        # Wait a moment and check again (SMS might be queued)
-                        import time
-                        time.sleep(1)
-                        sms_record.invalidate_cache()
-                        if sms_record.state in ['sent', 'outgoing']:
-                            _logger.info("SMS was sent successfully (after delay)")
-                            return
-                        else:
-                            raise Exception("SMS sending failed due to gateway compatibility issue")
-                else:
-                    # Re-raise other errors
-                    raise send_error
-            
-            # Check if sending was successful
-            if sms_record.state == 'error':
-                error_msg = sms_record.sms_api_error or sms_record.failure_type or 'Unknown SMS error'
-                raise Exception(f"SMS sending failed: {error_msg}")
-            elif sms_record.state not in ['sent', 'outgoing']:
-                # Sometimes the state might be something else, log it for debugging
-                _logger.warning(
-                    "SMS state after sending: %s for order %s", 
-                    sms_record.state, self.name
-                )
-                
-        except Exception as e:
-            _logger.error("Failed to send SMS for order %s: %s", self.name, str(e))
-            raise
+        """Send an SMS message using the configured gateway.
+
+        The message goes through a dispatch, so gateway failures are retried
+        in the background instead of blocking the caller.
+        """
+        self.ensure_one()
+        dispatch = self.env['pos.sms.receipt.dispatch'].sudo().create({
+            'order_id': self.id,
+            'phone': phone,
+            'lang': self.env.context.get('lang', 'da_DK'),
+            'body': body,
+        })
+        dispatch._send()
+        if dispatch.state == 'failed':
+            raise UserError(_("SMS sending failed: %s") % dispatch.error)
+        return dispatch
 
     def button_send_sms_receipt_backend(self):
         """Backend button to send/resend SMS receipt."""
         self.ensure_one()
 
-        phone_to_use = (
-            self.phone_for_sms_receipt or
-            (self.partner_id.mobile if self.partner_id else None) or
-            (self.partner_id.phone if self.partner_id else None)
-        )
+        phone_to_use = self._get_sms_receipt_phone()
 
         if not phone_to_use:
             raise UserError(_(
@@ -300,6 +579,17 @@ class PosOrder(models.Model):
         if isinstance(result, dict) and result.get('error'):
             raise UserError(_("Failed to send SMS: %s") % result['error'])
 
+        if isinstance(result, dict) and result.get('queued'):
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _('SMS Queued'),
+                    'message': _('SMS receipt queued for sending to %s') % phone_to_use,
+                    'type': 'info',
+                }
+            }
+
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
@@ -310,71 +600,314 @@ class PosOrder(models.Model):
             }
         }
 
+    def _get_sms_receipt_phone(self):
+        """Get the phone number to send the receipt to: order phone, then customer mobile or phone."""
+        self.ensure_one()
+        return (
+            self.phone_for_sms_receipt or
+            (self.partner_id.mobile if self.partner_id else None) or
+            (self.partner_id.phone if self.partner_id else None)
+        )
+
+    def action_send_sms_receipts_bulk(self):
+        """Send the SMS receipts of many orders at once, from the list view.
+
+        Orders already sent, not paid yet or without any phone number are
+        skipped. The SMS records are created with one batched create and
+        handed to the gateway in chunks; receipts the gateway holds back or
+        fails to send for now are reported as queued.
+        """
+        orders = self.filtered(lambda o: o.state not in ('draft', 'cancel') and not o.is_sms_receipt_sent)
+        skipped = len(self) - len(orders)
+
+        # The normalized phones are stored, nothing is parsed again here
+        orders.fetch(['name', 'phone_for_sms_receipt', 'sms_phone_e164', 'partner_id'])
+        orders.partner_id.fetch(['sms_phone_e164', 'mobile', 'phone'])
+
+        dispatch_vals = []
+        invalid = {}
+        for order in orders:
+            phone_e164 = order._get_sms_receipt_e164()
+            if phone_e164:
+                dispatch_vals.append({
+                    'order_id': order.id,
+                    'phone': phone_e164,
+                })
+                continue
+            phone = order._get_sms_receipt_phone()
+            if not phone:
+                skipped += 1
+                continue
+            invalid[order] = _("Invalid phone number format.")
+
+        self.env['pos.sms.receipt.dispatch']._log_rejected([{
+            'order_id': order.id,
+            'phone': order._get_sms_receipt_phone(),
+            'error': error_msg,
+        } for order, error_msg in invalid.items()])
+
+        dispatches = self.env['pos.sms.receipt.dispatch']._dispatch_receipts(dispatch_vals, immediate=True)
+
+        # Receipts held back by the gateway, waiting for a retry or sent by
+        # an earlier request still in progress are queued
+        sent = len([dispatch for dispatch in dispatches if dispatch.state == 'sent'])
+        failed = len([dispatch for dispatch in dispatches if dispatch.state == 'failed']) + len(invalid)
+        queued = len([dispatch for dispatch in dispatches if dispatch.state in WAITING_DISPATCH_STATES])
+        _logger.info(
+            "Bulk SMS receipts: %s sent, %s queued, %s skipped, %s failed",
+            sent, queued, skipped, failed
+        )
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('SMS Receipts'),
+                'message': _(
+                    "%(sent)s sent, %(queued)s queued, %(skipped)s skipped, %(failed)s failed",
+                    sent=sent, queued=queued, skipped=skipped, failed=failed
+                ),
+                'type': 'warning' if failed else 'success',
+                'sticky': bool(failed),
+            }
+        }
+
     def _render_custom_sms_receipt(self):
         """Render SMS receipt using customizable template."""
-        # Get the template for this company and user's language
+        self.ensure_one()
+        return self._render_sms_receipts()[self.id]
+
+    def _render_sms_receipts(self):
+        """Render the SMS receipts of all orders in a single pass.
+
+        The data used by the templates is fetched in bulk for the whole
+        recordset first, so resending or auditing many receipts does not
+        read lines, products, payments, partners and companies per order.
+
+        :return: dict {order id: SMS body}
+        """
+        # Get the templates for the companies and user's language
+        user_lang = self.env.context.get('lang', 'da_DK')
+        self._prefetch_sms_receipt_data()
+        self.env['pos.sms.receipt.metric']._schedule_flush()
+
+        templates = {}
+        renderers = {}
+        link_renderers = {}
+        tax_lines = None
+        bodies = {}
+        for order in self:
+            template = templates.get(order.company_id.id)
+            if template is None:
+                with dispatch_metrics.timer('stage_seconds', stage='template'):
+                    template = templates[order.company_id.id] = self.env['sms.receipt.template'].get_default_template(
+                        company_id=order.company_id.id,
+                        language=user_lang
+                    )
+            if template.delivery_mode == 'link':
+                # Constant size message, the receipt itself is served by the link
+                render_link = link_renderers.get(order.company_id.id)
+                if render_link is None:
+                    render_link = link_renderers[order.company_id.id] = compile_template(
+                        template.link_message_template or ''
+                    )
+                bodies[order.id] = render_link({
+                    'company_name': order.company_id.name,
+                    'order_name': order.name,
+                    'receipt_url': order._get_sms_receipt_url(),
+                })
+                continue
+            renderer = renderers.get(order.company_id.id)
+            if renderer is None:
+                # The template is compiled once and cached, rendering only binds the order data
+                with dispatch_metrics.timer('stage_seconds', stage='template'):
+                    renderer = renderers[order.company_id.id] = template._get_receipt_renderer()
+            if tax_lines is None and 'tax' in renderer.section_names:
+                # Tax breakdown of all the orders at once
+                tax_lines = self._get_sms_receipt_tax_lines()
+            # Compacted to the segment budget of the template, if any
+            with dispatch_metrics.timer('stage_seconds', stage='render'):
+                bodies[order.id] = renderer.render_sms(order._get_sms_receipt_values(
+                    renderer.section_names, user_lang, (tax_lines or {}).get(order.id, [])
+                ))
+        return bodies
+
+    def _get_sms_receipt_url(self):
+        """Get the public receipt link of the order.
+
+        The token is given to the order on its creation and the link expires
+        from the last sending, so rendering a link only reads the order.
+        """
+        self.ensure_one()
+        order = self.sudo()
+        return '%s/pos_sms_receipt/r/%s' % (order.get_base_url(), order.sms_receipt_token)
+
+    def _get_sms_receipt_web_body(self):
+        """Get the full receipt served by the receipt link.
+
+        The receipt is rendered on each view without writing the order, so
+        public traffic never locks it; the ETag lets browsers revalidate
+        their cached copy instead.
+
+        :return: tuple (body, etag)
+        """
+        self.ensure_one()
+        order = self.sudo()
         user_lang = self.env.context.get('lang', 'da_DK')
         template = self.env['sms.receipt.template'].get_default_template(
-            company_id=self.company_id.id,
+            company_id=order.company_id.id,
             language=user_lang
         )
-        
-        body_parts = []
-        
+        renderer = template._get_receipt_renderer()
+        # Full receipt, the web page has no segment budget
+        body = renderer.render(order._get_sms_receipt_values(renderer.section_names, user_lang))
+        return body, hashlib.sha256(body.encode()).hexdigest()[:32]
+
+    @api.model
+    def _get_order_by_sms_receipt_token(self, token):
+        """Get the order of a receipt link token, empty if unknown or expired."""
+        if not token:
+            return self.browse()
+        order = self.sudo().search([('sms_receipt_token', '=', token)], limit=1)
+        if not order.sms_receipt_token_expiry or order.sms_receipt_token_expiry <= fields.Datetime.now():
+            return self.browse()
+        return order
+
+    @api.model
+    def _init_sms_receipt_tokens(self):
+        """Give a receipt link token of its own to the orders created without one.
+
+        A new token column gets the same default value on all the existing
+        orders, these are replaced by random tokens too.
+        """
+        cr = self.env.cr
+        cr.execute("""
+            SELECT id FROM pos_order
+             WHERE sms_receipt_token IS NULL
+                OR sms_receipt_token IN (
+                    SELECT sms_receipt_token FROM pos_order
+                     GROUP BY sms_receipt_token HAVING count(*) > 1
+                )
+        """)
+        order_ids = [row[0] for row in cr.fetchall()]
+        for batch in split_every(TOKEN_BATCH_SIZE, order_ids):
+            cr.execute("""
+                UPDATE pos_order o SET sms_receipt_token = t.token
+                  FROM (VALUES %s) AS t (id, token)
+                 WHERE o.id = t.id
+            """ % ', '.join(['(%s, %s)'] * len(batch)),
+                [param for order_id in batch for param in (order_id, secrets.token_urlsafe(16))])
+        self.invalidate_model(['sms_receipt_token'])
+        _logger.info("Created the SMS receipt link tokens of %s orders", len(order_ids))
+
+    def _prefetch_sms_receipt_data(self):
+        """Fetch everything the receipt templates read, with one query per model."""
+        self.fetch([
+            'name', 'pos_reference', 'date_order', 'amount_total', 'amount_tax',
+            'company_id', 'partner_id', 'lines', 'payment_ids',
+        ])
+        self.lines.fetch(['product_id', 'qty', 'price_subtotal_incl'])
+        self.lines.product_id.fetch(['product_tmpl_id'])
+        self.lines.product_id.product_tmpl_id.fetch(['name'])
+        self.payment_ids.fetch(['amount', 'payment_method_id'])
+        self.payment_ids.payment_method_id.fetch(['name'])
+        self.partner_id.fetch(['name'])
+        self.company_id.fetch(['name', 'phone', 'vat', 'email', 'website'])
+
+    def _get_sms_receipt_tax_lines(self):
+        """Break the taxes of the orders down by tax, reading the lines of all orders at once.
+
+        Each line's tax and base are split per tax as the order computes
+        them, so a line with several taxes counts in each with its share
+        only. Identical lines (taxes, product, price, quantity, currency and
+        customer) are computed once, within an order and across orders.
+
+        :return: dict {order id: list of tax line values, highest rate first}
+        """
+        lines = self.lines
+        lines.fetch(['order_id', 'product_id', 'qty', 'price_unit', 'discount', 'tax_ids'])
+        self.fetch(['fiscal_position_id', 'partner_id', 'currency_id'])
+        lines.tax_ids.fetch(['name', 'amount', 'amount_type'])
+
+        batches = {}
+        for line in lines:
+            order = line.order_id
+            taxes = order.fiscal_position_id.map_tax(line.tax_ids)
+            if not taxes:
+                continue
+            price = line.price_unit * (1 - (line.discount or 0.0) / 100.0)
+            key = (taxes, line.product_id, price, line.qty, order.currency_id, order.partner_id)
+            counts = batches.setdefault(key, {})
+            counts[order.id] = counts.get(order.id, 0) + 1
+
+        amounts = {}
+        for (taxes, product, price, qty, currency, partner), counts in batches.items():
+            result = taxes.compute_all(price, currency, qty, product=product, partner=partner)
+            for order_id, count in counts.items():
+                for tax_values in result['taxes']:
+                    amount = amounts.setdefault((order_id, tax_values['id']), [0.0, 0.0])
+                    amount[0] += tax_values['amount'] * count
+                    amount[1] += tax_values['base'] * count
+
+        taxes = self.env['account.tax'].browse({tax_id for _order_id, tax_id in amounts})
+        taxes_by_id = {tax.id: tax for tax in taxes}
+        tax_lines = {}
+        for (order_id, tax_id), (tax_amount, base) in sorted(
+            amounts.items(), key=lambda item: -taxes_by_id[item[0][1]].amount
+        ):
+            tax = taxes_by_id[tax_id]
+            tax_lines.setdefault(order_id, []).append({
+                'tax_rate': f"{tax.amount:g}%" if tax.amount_type == 'percent' else tax.name,
+                'tax_name': tax.name,
+                'tax_amount': f"{tax_amount:.2f}",
+                'tax_base': f"{base:.2f}",
+                'total': f"{base + tax_amount:.2f}",
+            })
+        return tax_lines
+
+    def _get_sms_receipt_values(self, sections, user_lang, tax_lines=None):
+        """Collect the values bound to each enabled receipt section, by section name.
+
+        :param tax_lines: tax breakdown of the order, see ``_get_sms_receipt_tax_lines``
+        """
+        values = {}
+        company = self.company_id
+
         # Company Information
-        if template.show_company_info and template.company_info_template:
-            phone_line = f"Telefon: {self.company_id.phone}" if self.company_id.phone else ""
-            vat_line = f"CVR: {self.company_id.vat}" if self.company_id.vat else ""
-            email_line = self.company_id.email if self.company_id.email else ""
-            website_line = self.company_id.website if self.company_id.website else ""
-            
-            company_info = template.company_info_template.format(
-                company_name=self.company_id.name,
-                phone_line=phone_line,
-                vat_line=vat_line,
-                email_line=email_line,
-                website_line=website_line
-            )
-            # Remove empty lines
-            company_info = '\n'.join(line for line in company_info.split('\n') if line.strip())
-            body_parts.append(company_info)
-        
+        if 'company_info' in sections:
+            values['company_info'] = {
+                'company_name': company.name,
+                'phone_line': f"Telefon: {company.phone}" if company.phone else "",
+                'vat_line': f"CVR: {company.vat}" if company.vat else "",
+                'email_line': company.email if company.email else "",
+                'website_line': company.website if company.website else "",
+            }
+
         # Separator
-        if template.show_separator and template.separator_line:
-            body_parts.append(template.separator_line)
-        
+        if 'separator' in sections:
+            values['separator'] = {}
+
         # Order Information
-        if template.show_order_info and template.order_info_template:
-            served_by_line = f"Betjent af {self.partner_id.name}" if self.partner_id and self.partner_id.name else ""
-            
-            order_info = template.order_info_template.format(
-                served_by_line=served_by_line,
-                order_name=self.name,
-                order_date=self.date_order.strftime('%d-%m-%Y %H:%M')
-            )
-            # Remove empty lines
-            order_info = '\n'.join(line for line in order_info.split('\n') if line.strip())
-            body_parts.append(order_info)
-        
+        if 'order_info' in sections:
+            values['order_info'] = {
+                'served_by_line': f"Betjent af {self.partner_id.name}" if self.partner_id and self.partner_id.name else "",
+                'order_name': self.name,
+                'order_date': self.date_order.strftime('%d-%m-%Y %H:%M'),
+            }
+
         # Items
-        if template.show_items and template.item_line_template:
-            items_text = ""
-            for line in self.lines:
-                item_line = template.item_line_template.format(
-                    product_name=line.product_id.name,
-                    qty=f"{line.qty:.0f}",
-                    price=f"{line.price_subtotal_incl:.2f}"
-                )
-                items_text += item_line + "\n"
-            if items_text:
-                body_parts.append(items_text.rstrip())
-        
+        if 'items' in sections:
+            values['items'] = [{
+                'product_name': line.product_id.name,
+                'qty': f"{line.qty:.0f}",
+                'price': f"{line.price_subtotal_incl:.2f}",
+            } for line in self.lines]
+
         # Total
-        if template.show_total and template.total_template:
+        if 'total' in sections:
             payment_method = "Kontant"
             payment_amount = self.amount_total
             change_amount = 0.0
-            
+
             if self.payment_ids:
                 payment_method = self.payment_ids[0].payment_method_id.name
                 payment_amount = sum(payment.amount for payment in self.payment_ids)
@@ -382,53 +915,48 @@ class PosOrder(models.Model):
                 change_amount = payment_amount - self.amount_total
                 # Ensure change is not negative (in case of underpayment)
                 change_amount = max(0.0, change_amount)
-            
-            total_section = template.total_template.format(
-                total=f"{self.amount_total:.2f}",
-                payment_method=payment_method,
-                amount=f"{payment_amount:.2f}",
-                change=f"{change_amount:.2f}"
-            )
-            body_parts.append(total_section)
-        
+
+            values['total'] = {
+                'total': f"{self.amount_total:.2f}",
+                'payment_method': payment_method,
+                'amount': f"{payment_amount:.2f}",
+                'change': f"{change_amount:.2f}",
+            }
+
         # Tax
-        if template.show_tax and template.tax_template and self.amount_tax > 0:
-            tax_base = self.amount_total - self.amount_tax
-            tax_section = template.tax_template.format(
-                tax_amount=f"{self.amount_tax:.2f}",
-                tax_base=f"{tax_base:.2f}",
-                total=f"{self.amount_total:.2f}"
-            )
-            body_parts.append(tax_section)
-        
+        if 'tax' in sections and self.amount_tax > 0:
+            if tax_lines is None:
+                tax_lines = self._get_sms_receipt_tax_lines().get(self.id, [])
+            values['tax'] = {
+                'tax_lines': tax_lines,
+                'tax_amount': f"{self.amount_tax:.2f}",
+                'tax_base': f"{self.amount_total - self.amount_tax:.2f}",
+                'total': f"{self.amount_total:.2f}",
+            }
+
         # Customer
-        if template.show_customer and template.customer_template and self.partner_id and self.partner_id.name:
-            customer_section = template.customer_template.format(
-                customer_name=self.partner_id.name
-            )
-            body_parts.append(customer_section)
-        
+        if 'customer' in sections and self.partner_id and self.partner_id.name:
+            values['customer'] = {
+                'customer_name': self.partner_id.name,
+            }
+
         # Footer
-        if template.show_footer and template.footer_template:
+        if 'footer' in sections:
             website_line = ""
-            if self.company_id.website:
+            if company.website:
                 # Use language-appropriate text for website reference
                 if user_lang.startswith('da'):
-                    website_line = f"Besøg {self.company_id.website} for mere information"
+                    website_line = f"Besøg {company.website} for mere information"
                 elif user_lang.startswith('de'):
-                    website_line = f"Besuchen Sie {self.company_id.website} für weitere Informationen"
+                    website_line = f"Besuchen Sie {company.website} für weitere Informationen"
                 else:  # Default to English
-                    website_line = f"Visit {self.company_id.website} for more information"
-            
-            footer_section = template.footer_template.format(
-                website_line=website_line,
-                unique_code=self.pos_reference or self.name,
-                order_name=self.name,
-                order_datetime=self.date_order.strftime('%d-%m-%Y %H:%M:%S')
-            )
-            # Remove empty lines
-            footer_section = '\n'.join(line for line in footer_section.split('\n') if line.strip())
-            body_parts.append(footer_section)
-        
-        # Join all parts
-        return '\n\n'.join(part for part in body_parts if part.strip())
\ No newline at end of file
+                    website_line = f"Visit {company.website} for more information"
+
+            values['footer'] = {
+                'website_line': website_line,
+                'unique_code': self.pos_reference or self.name,
+                'order_name': self.name,
+                'order_datetime': self.date_order.strftime('%d-%m-%Y %H:%M:%S'),
+            }
+
+        return values
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, tools
+from datetime import timedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Minutes an open circuit waits before letting a trial send through
+DEFAULT_CIRCUIT_COOLDOWN = 5
+
+
+class PosSmsGatewayState(models.Model):
+    """Rate limiter and circuit breaker state of an SMS gateway account.
+
+    One row per gateway account (an empty gateway being the default SMS
+    gateway), shared by all workers. The state is read and updated with a
+    row lock in a short transaction of its own, so tills sending through the
+    same gateway never wait on each other's gateway calls.
+    """
+    _name = 'pos.sms.gateway.state'
+    _description = 'POS SMS Gateway State'
+    _rec_name = 'gateway_id'
+    _order = 'id'
+
+    gateway_id = fields.Many2one(
+        'iap.account',
+        string="SMS Gateway Account",
+        ondelete='cascade',
+        readonly=True,
+        help="Empty for the default SMS gateway."
+    )
+    tokens = fields.Float(
+        string="Available Sends",
+        readonly=True,
+        help="Sends left in the rate limiter bucket at the last refill."
+    )
+    last_refill = fields.Datetime(
+        string="Last Refill",
+        readonly=True
+    )
+    circuit_state = fields.Selection(
+        selection=[
+            ('closed', 'Closed'),
+            ('open', 'Open'),
+            ('half_open', 'Half Open'),
+        ],
+        string="Circuit",
+        default='closed',
+        required=True,
+        readonly=True,
+        help="Closed: receipts are sent to the gateway. Open: the gateway "
+             "failed repeatedly, receipts are queued until the cooldown has "
+             "passed. Half Open: one trial send decides whether to close again."
+    )
+    consecutive_failures = fields.Integer(
+        string="Consecutive Failures",
+        readonly=True
+    )
+    opened_at = fields.Datetime(
+        string="Opened On",
+        readonly=True
+    )
+    last_failure = fields.Text(
+        string="Last Failure",
+        readonly=True
+    )
+
+    def init(self):
+        tools.create_unique_index(
+            self._cr, 'pos_sms_gateway_state_gateway_uniq', self._table, ['COALESCE(gateway_id, 0)']
+        )
+
+    @api.model
+    def _peek_state(self, gateway):
+        """Read the circuit state and failure count of the gateway without locking.
+
+        Read in the transaction of the send batch, once: the chunks of the
+        batch then go by the state kept by ``_cache_state``, which the
+        results of the chunks update from the state locked whenever a
+        chunk fails, so failures recorded by other workers are seen too.
+
+        :return: tuple (circuit_state, consecutive_failures)
+        """
+        self.env.cr.execute("""
+            SELECT circuit_state, consecutive_failures
+              FROM pos_sms_gateway_state
+             WHERE COALESCE(gateway_id, 0) = %s
+        """, [gateway.id or 0])
+        row = self.env.cr.fetchone()
+        return self._cache_state(gateway, tuple(row) if row else ('closed', 0))
+
+    @api.model
+    def _cache_state(self, gateway, state):
+        """Keep the last circuit state read or written for the gateway."""
+        self.env.cr.cache.setdefault('pos_sms_gateway_state', {})[gateway.id] = state
+        return state
+
+    @api.model
+    def _last_state(self, gateway):
+        """Get the last circuit state read or written for the gateway, reading it if unknown."""
+        state = self.env.cr.cache.get('pos_sms_gateway_state', {}).get(gateway.id)
+        return state or self._peek_state(gateway)
+
+    @api.model
+    def _lock_state(self, cr, gateway):
+        """Create the state row of the gateway if needed and lock it in ``cr``."""
+        cr.execute("""
+            INSERT INTO pos_sms_gateway_state (gateway_id, tokens, circuit_state, consecutive_failures,
+                                               create_date, write_date)
+            VALUES (%s, 0, 'closed', 0, NOW() AT TIME ZONE 'UTC', NOW() AT TIME ZONE 'UTC')
+            ON CONFLICT DO NOTHING
+        """, [gateway.id or None])
+        cr.execute("""
+            SELECT id, tokens, last_refill, circuit_state, consecutive_failures, opened_at
+              FROM pos_sms_gateway_state
+             WHERE COALESCE(gateway_id, 0) = %s
+               FOR UPDATE
+        """, [gateway.id or 0])
+        return cr.dictfetchone()
+
+    @api.model
+    def _acquire(self, gateway, count, policy):
+        """Take up to ``count`` send permits of the gateway.
+
+        :param policy: dict from ``pos.config._get_sms_gateway_policy``
+        :return: tuple (granted, retry_at), ``retry_at`` being when the
+                 sends not granted may be tried again
+        """
+        rate_limit, threshold = policy['rate_limit'], policy['circuit_threshold']
+        if not rate_limit and not threshold:
+            return count, None
+
+        if not rate_limit and self._last_state(gateway)[0] == 'closed':
+            # Healthy gateway without rate limit, nothing to lock
+            return count, None
+
+        now = fields.Datetime.now()
+        granted, retry_at = count, None
+        with self.env.registry.cursor() as cr:
+            state = self._lock_state(cr, gateway)
+            circuit = state['circuit_state']
+            opened_at = state['opened_at']
+            if threshold and circuit != 'closed':
+                reopen_at = opened_at + timedelta(minutes=policy['circuit_cooldown'])
+                if now < reopen_at:
+                    # Open, or a trial send is in flight
+                    return 0, reopen_at
+                # Cooldown passed: a single trial send decides for the others
+                circuit, opened_at, granted = 'half_open', now, 1
+                retry_at = now + timedelta(minutes=policy['circuit_cooldown'])
+                trial = True
+            else:
+                trial = False
+
+            tokens = state['tokens']
+            if rate_limit:
+                # Bucket of one minute of sends, refilled continuously
+                per_second = rate_limit / 60.0
+                if state['last_refill']:
+                    elapsed = (now - state['last_refill']).total_seconds()
+                    tokens = min(rate_limit, tokens + elapsed * per_second)
+                else:
+                    tokens = rate_limit
+                granted = min(granted, int(tokens))
+                tokens -= granted
+                if granted < count:
+                    wait = timedelta(seconds=(1 - tokens) / per_second)
+                    retry_at = max(retry_at, now + wait) if retry_at else now + wait
+                if trial and not granted:
+                    # No permit for the trial send, stay open
+                    circuit, opened_at = state['circuit_state'], state['opened_at']
+
+            cr.execute("""
+                UPDATE pos_sms_gateway_state
+                   SET tokens = %s, last_refill = %s, circuit_state = %s, opened_at = %s,
+                       write_date = NOW() AT TIME ZONE 'UTC'
+                 WHERE id = %s
+            """, [tokens, now, circuit, opened_at, state['id']])
+        self._cache_state(gateway, (circuit, state['consecutive_failures']))
+        return granted, retry_at
+
+    @api.model
+    def _record_result(self, gateway, success, policy, error_msg=None):
+        """Close the circuit of the gateway after a success, count a failure otherwise.
+
+        The circuit opens after ``circuit_threshold`` consecutive failures,
+        or after the failure of a trial send.
+        """
+        if not policy['circuit_threshold']:
+            return
+        # The state read when the chunk was admitted, a chunk sent fine
+        # through a closed circuit has nothing to record
+        if success and self._last_state(gateway) == ('closed', 0):
+            return
+        with self.env.registry.cursor() as cr:
+            state = self._lock_state(cr, gateway)
+            if success:
+                self._cache_state(gateway, ('closed', 0))
+                if state['circuit_state'] == 'closed' and not state['consecutive_failures']:
+                    return
+                cr.execute("""
+                    UPDATE pos_sms_gateway_state
+                       SET circuit_state = 'closed', consecutive_failures = 0, opened_at = NULL,
+                           write_date = NOW() AT TIME ZONE 'UTC'
+                     WHERE id = %s
+                """, [state['id']])
+                if state['circuit_state'] != 'closed':
+                    _logger.info("SMS gateway %s recovered, circuit closed", gateway.display_name or 'default')
+                return
+
+            failures = state['consecutive_failures'] + 1
+            circuit, opened_at = state['circuit_state'], state['opened_at']
+            if circuit == 'half_open' or failures >= policy['circuit_threshold']:
+                if circuit != 'open':
+                    _logger.warning(
+                        "SMS gateway %s failed %s times in a row, circuit opened: %s",
+                        gateway.display_name or 'default', failures, error_msg
+                    )
+                circuit, opened_at = 'open', fields.Datetime.now()
+            cr.execute("""
+                UPDATE pos_sms_gateway_state
+                   SET circuit_state = %s, consecutive_failures = %s, opened_at = %s, last_failure = %s,
+                       write_date = NOW() AT TIME ZONE 'UTC'
+                 WHERE id = %s
+            """, [circuit, failures, opened_at, error_msg, state['id']])
+            self._cache_state(gateway, (circuit, failures))
+
+    def action_reset(self):
+        """Close the circuit and refill the bucket, e.g. after fixing the gateway."""
+        self.write({
+            'circuit_state': 'closed',
+            'consecutive_failures': 0,
+            'opened_at': False,
+            'last_refill': False,
+        })
+        return True
@@ -0,0 +1,783 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, tools, _
+from datetime import timedelta
+from psycopg2.errors import UniqueViolation
+import hashlib
+import logging
+import random
+import threading
+
+from ..tools.metrics import dispatch_metrics
+from ..tools.phone_numbers import redact_phone, redact_phones_in_text
+from ..tools.sms_segments import segment_count
+
+_logger = logging.getLogger(__name__)
+
+# Number of dispatches handled per cron run and per gateway call
+DISPATCH_BATCH_SIZE = 100
+
+# Retry backoff bounds (seconds) and jitter ratio of failed dispatches
+RETRY_BASE_DELAY = 60
+RETRY_MAX_DELAY = 6 * 3600
+RETRY_JITTER = 0.2
+
+# SMS failure types that a retry cannot fix
+PERMANENT_FAILURE_TYPES = (
+    'sms_number_missing',
+    'sms_number_format',
+    'sms_blacklist',
+    'sms_optout',
+    'sms_duplicate',
+)
+
+# Retention: days after which the phones of SMS receipts are redacted and
+# their dispatches deleted, set with these ir.config_parameter keys (0 disables)
+REDACT_DAYS_PARAM = 'pos_sms_receipt.redact_after_days'
+RETENTION_DAYS_PARAM = 'pos_sms_receipt.retention_days'
+DEFAULT_REDACT_DAYS = 90
+DEFAULT_RETENTION_DAYS = 730
+
+# Rows handled per retention batch, each batch in a transaction of its own
+RETENTION_BATCH_SIZE = 1000
+
+# Dispatches read per batch of the audit export
+EXPORT_BATCH_SIZE = 500
+
+# Columns of the audit export
+EXPORT_COLUMNS = (
+    'order', 'pos_reference', 'order_date', 'point_of_sale', 'phone', 'state',
+    'sent_at', 'attempts', 'segments', 'encoding', 'gateway', 'error', 'body',
+)
+
+# Dispatch states of receipts still to be sent
+WAITING_DISPATCH_STATES = ('queued', 'sending', 'retry')
+
+# Known gatewayapi-sms compatibility errors; the SMS is usually sent anyway
+COMPATIBILITY_ERRORS = (
+    ("_get_sms_account", "read-only"),
+    ("failure_type", "sms_server_error"),
+)
+
+
+class PosSmsReceiptDispatch(models.Model):
+    """Log of the SMS receipt requests of orders, one dispatch per request.
+
+    Dispatches are only inserted by the sending path and updated by the
+    workers sending them; the SMS receipt status of an order is computed
+    from its dispatches, so sending never writes the orders.
+    """
+    _name = 'pos.sms.receipt.dispatch'
+    _description = 'POS SMS Receipt Dispatch'
+    _order = 'id desc'
+    _rec_name = 'order_id'
+
+    order_id = fields.Many2one(
+        'pos.order',
+        string="Order",
+        required=True,
+        index=True,
+        ondelete='cascade',
+        readonly=True
+    )
+    config_id = fields.Many2one(
+        related='order_id.config_id',
+        string="Point of Sale",
+        store=True
+    )
+    phone = fields.Char(
+        string="Phone",
+        required=True,
+        readonly=True
+    )
+    lang = fields.Char(
+        string="Language",
+        readonly=True,
+        help="Language used to render the receipt body."
+    )
+    state = fields.Selection(
+        selection=[
+            ('queued', 'Queued'),
+            ('sending', 'Sending'),
+            ('retry', 'Waiting Retry'),
+            ('sent', 'Sent'),
+            ('failed', 'Failed'),
+        ],
+        string="Status",
+        default='queued',
+        required=True,
+        readonly=True
+    )
+    error = fields.Text(
+        string="Error",
+        readonly=True
+    )
+    gateway_id = fields.Many2one(
+        'iap.account',
+        string="SMS Gateway Account",
+        compute='_compute_gateway_id',
+        store=True,
+        precompute=True,
+        help="Gateway account of the Point of Sale when the receipt was queued. "
+             "Empty for the default SMS gateway."
+    )
+    attempt_count = fields.Integer(
+        string="Attempts",
+        default=0,
+        readonly=True,
+        copy=False
+    )
+    next_attempt = fields.Datetime(
+        string="Next Attempt",
+        readonly=True,
+        copy=False,
+        help="When the failed dispatch is sent again."
+    )
+    sent_at = fields.Datetime(
+        string="Sent On",
+        readonly=True,
+        copy=False
+    )
+    sms_id = fields.Many2one(
+        'sms.sms',
+        string="SMS",
+        ondelete='set null',
+        readonly=True
+    )
+    body = fields.Text(
+        string="Body",
+        readonly=True,
+        help="Rendered SMS receipt body."
+    )
+    encoding = fields.Selection(
+        selection=[
+            ('gsm7', 'GSM-7'),
+            ('ucs2', 'UCS-2'),
+        ],
+        string="Encoding",
+        compute='_compute_segments',
+        store=True,
+        readonly=True
+    )
+    segments = fields.Integer(
+        string="Segments",
+        compute='_compute_segments',
+        store=True,
+        readonly=True,
+        help="Number of SMS segments the body is billed as."
+    )
+    dedup_key = fields.Char(
+        string="Deduplication Key",
+        index=True,
+        readonly=True,
+        copy=False,
+        help="Hash of the order, normalized phone and rendered body. Identical "
+             "requests within the deduplication window reuse this dispatch."
+    )
+
+    def init(self):
+        # A deduplication key is held by a single dispatch not failed, so
+        # concurrent identical requests cannot both create one
+        if not tools.sql.index_exists(self.env.cr, 'pos_sms_receipt_dispatch_dedup_uniq'):
+            self.env.cr.execute("""
+                UPDATE pos_sms_receipt_dispatch dispatch
+                   SET dedup_key = NULL
+                 WHERE dedup_key IS NOT NULL AND state != 'failed'
+                   AND EXISTS (
+                       SELECT 1 FROM pos_sms_receipt_dispatch later
+                        WHERE later.dedup_key = dispatch.dedup_key
+                          AND later.state != 'failed' AND later.id > dispatch.id
+                   )
+            """)
+            self.env.cr.execute("""
+                CREATE UNIQUE INDEX pos_sms_receipt_dispatch_dedup_uniq
+                    ON pos_sms_receipt_dispatch (dedup_key)
+                 WHERE dedup_key IS NOT NULL AND state != 'failed'
+            """)
+        # Only the dispatches waiting to be sent and the failed ones are
+        # searched by state, the sent ones pile up
+        tools.create_index(
+            self.env.cr, 'pos_sms_receipt_dispatch_waiting_idx', self._table,
+            ['state', 'next_attempt'],
+            where="state IN ('queued', 'sending', 'retry')",
+        )
+        tools.create_index(
+            self.env.cr, 'pos_sms_receipt_dispatch_failed_idx', self._table,
+            ['create_date'],
+            where="state = 'failed'",
+        )
+        tools.create_index(
+            self.env.cr, 'pos_sms_receipt_dispatch_sent_at_idx', self._table,
+            ['sent_at'],
+            where="sent_at IS NOT NULL",
+        )
+
+    @api.depends('order_id')
+    def _compute_gateway_id(self):
+        for dispatch in self:
+            dispatch.gateway_id = dispatch.order_id.config_id.sms_gateway_id
+
+    @api.depends('body')
+    def _compute_segments(self):
+        for dispatch in self:
+            if dispatch.body:
+                dispatch.encoding, dispatch.segments = segment_count(dispatch.body)
+            else:
+                dispatch.encoding, dispatch.segments = False, 0
+
+    @api.model
+    def _dispatch_receipts(self, vals_list, immediate=None):
+        """Dispatch SMS receipts, reusing recent identical dispatches.
+
+        The bodies are rendered in bulk and each receipt gets a deduplication
+        key of (order, normalized phone, body hash). A request matching a
+        dispatch not failed within the deduplication window of its POS
+        returns that dispatch instead of creating another SMS, so repeated
+        taps and retries are not sent and billed twice. A key is held by a
+        single dispatch not failed: a request racing an identical one still
+        in progress waits for it, then returns its dispatch.
+
+        :param vals_list: list of {'order_id': order id, 'phone': normalized phone}
+        :param immediate: True to send now, False to queue, None to follow
+                          the dispatch mode of each POS
+        :return: list of dispatches, one per item of ``vals_list``
+        """
+        # Whole request, from the rendering to the gateway call in immediate mode
+        self.env['pos.sms.receipt.metric']._schedule_flush()
+        with dispatch_metrics.timer('stage_seconds', stage='total'):
+            lang = self.env.context.get('lang', 'da_DK')
+            orders = self.env['pos.order'].browse([vals['order_id'] for vals in vals_list])
+            bodies = self._render_order_bodies(orders, lang)
+
+            keys = [
+                self._get_dedup_key(vals['order_id'], vals['phone'], bodies.get(vals['order_id']))
+                for vals in vals_list
+            ]
+            # Receipts queued before being rendered hold the key of an empty body
+            queued_keys = [self._get_dedup_key(vals['order_id'], vals['phone'], False) for vals in vals_list]
+            now = fields.Datetime.now()
+            recent = {}
+            expired = self.browse()
+            domain = [('dedup_key', 'in', keys + queued_keys), ('state', '!=', 'failed')]
+            for dispatch in self.sudo().search(domain, order='id'):
+                window = timedelta(minutes=dispatch.config_id.sms_dedup_window)
+                if dispatch.create_date >= now - window:
+                    recent[dispatch.dedup_key] = dispatch
+                else:
+                    expired |= dispatch
+            # Dispatches past their window hand their key over to the new ones
+            expired.write({'dedup_key': False})
+
+            # Create the dispatches not seen yet, once per key
+            new_vals = {}
+            for vals, key, queued_key in zip(vals_list, keys, queued_keys):
+                if key not in recent and queued_key not in recent and key not in new_vals:
+                    new_vals[key] = dict(
+                        vals,
+                        lang=lang,
+                        body=bodies.get(vals['order_id'], False),
+                        dedup_key=key,
+                    )
+            try:
+                with self.env.cr.savepoint():
+                    new_dispatches = self.sudo().create(list(new_vals.values()))
+            except UniqueViolation:
+                # An identical request committed its dispatch after this
+                # transaction started: reuse its dispatches, create the others
+                _logger.info("Concurrent identical SMS receipt request, reusing its dispatch")
+                concurrent = self._browse_committed(list(new_vals))
+                recent.update((dispatch.dedup_key, dispatch) for dispatch in concurrent)
+                for key in recent:
+                    new_vals.pop(key, None)
+                new_dispatches = self.sudo().create(list(new_vals.values()))
+            recent.update(zip(new_vals, new_dispatches))
+
+            if immediate is None:
+                queued = new_dispatches.filtered(lambda d: d.config_id.sms_dispatch_mode == 'queued')
+            else:
+                queued = new_dispatches if not immediate else self.browse()
+            (new_dispatches - queued)._send()
+            cron = self._get_queue_cron()
+            if queued and cron:
+                cron._trigger()
+
+            return [recent.get(key) or recent[queued_key] for key, queued_key in zip(keys, queued_keys)]
+
+    @api.model
+    def _browse_committed(self, keys):
+        """Get the dispatches not failed holding the deduplication ``keys``, as committed.
+
+        Dispatches committed by another transaction after this one started
+        are not visible to it: they are read in a cursor of their own and
+        their values are put in the cache, so their status can be reported.
+        """
+        fnames = [name for name, field in self._fields.items() if field.store and field.column_type and name != 'id']
+        with self.env.registry.cursor() as cr:
+            cr.execute("""
+                SELECT id FROM pos_sms_receipt_dispatch
+                 WHERE dedup_key IN %s AND state != 'failed'
+            """, [tuple(keys)])
+            ids = [row[0] for row in cr.fetchall()]
+            rows = self.with_env(self.env(cr=cr, su=True)).browse(ids).read(fnames, load=None)
+        dispatches = self.sudo().browse(ids)
+        for dispatch, row in zip(dispatches, rows):
+            for fname in fnames:
+                field = self._fields[fname]
+                self.env.cache.update(dispatch, field, [field.convert_to_cache(row[fname], dispatch)])
+        return dispatches
+
+    @api.model
+    def _enqueue(self, vals_list):
+        """Queue receipts without rendering them, the queue renders them when sending.
+
+        Not rendered yet, the dispatches get the deduplication key of an
+        empty body, which later identical requests match as well.
+
+        :param vals_list: list of {'order_id': order id, 'phone': normalized phone}
+        """
+        if not vals_list:
+            return self.browse()
+        lang = self.env.context.get('lang', 'da_DK')
+        dispatches = self.sudo().create([
+            dict(vals, lang=lang, dedup_key=self._get_dedup_key(vals['order_id'], vals['phone'], False))
+            for vals in vals_list
+        ])
+        cron = self._get_queue_cron()
+        if cron:
+            cron._trigger()
+        return dispatches
+
+    @api.model
+    def _log_rejected(self, vals_list):
+        """Log the requests rejected before sending, e.g. for an invalid phone, as failed dispatches.
+
+        :param vals_list: list of {'order_id': order id, 'phone': phone as given, 'error': message}
+        """
+        if not vals_list:
+            return self.browse()
+        return self.sudo().create([
+            dict(vals, phone=vals.get('phone') or '-', state='failed')
+            for vals in vals_list
+        ])
+
+    @api.model
+    def _get_dedup_key(self, order_id, phone, body):
+        """Hash (order, normalized phone, rendered body) into a deduplication key."""
+        return hashlib.sha256(('%s|%s|%s' % (order_id, phone, body or '')).encode()).hexdigest()
+
+    @api.model
+    def _render_order_bodies(self, orders, lang):
+        """Render the receipt bodies of the orders in bulk, skipping unrenderable orders.
+
+        Bodies pre-rendered at sync time in the same language are used as is.
+
+        :return: dict {order id: SMS body}
+        """
+        orders = orders.with_context(lang=lang)
+        orders.fetch(['sms_receipt_body', 'sms_receipt_body_lang'])
+        bodies = {
+            order.id: order.sms_receipt_body
+            for order in orders
+            if order.sms_receipt_body and order.sms_receipt_body_lang == lang
+        }
+        orders = orders.filtered(lambda o: o.id not in bodies)
+        if not orders:
+            return bodies
+        try:
+            bodies.update(orders._render_sms_receipts())
+            return bodies
+        except Exception:
+            # Render one by one so a single bad order does not fail the batch
+            for order in orders:
+                try:
+                    bodies[order.id] = order._render_custom_sms_receipt()
+                except Exception as e:
+                    _logger.error("Failed to render SMS receipt for order %s: %s", order.name, e)
+            return bodies
+
+    @api.model
+    def _export_rows(self, domain, batch_size=EXPORT_BATCH_SIZE):
+        """Yield the audit export rows of the dispatches matching ``domain``.
+
+        Dispatches are walked by id in batches prefetched at once, and the
+        cache is cleared after each batch, so memory stays constant whatever
+        the number of rows. The body is the one sent; sent dispatches
+        without a stored body have it rendered again in bulk.
+
+        :return: generator of dicts keyed by ``EXPORT_COLUMNS``
+        """
+        last_id = 0
+        while True:
+            dispatches = self.search(domain + [('id', '>', last_id)], order='id', limit=batch_size)
+            if not dispatches:
+                return
+            dispatches.fetch([
+                'order_id', 'config_id', 'phone', 'lang', 'state', 'sent_at', 'attempt_count',
+                'segments', 'encoding', 'gateway_id', 'error', 'body',
+            ])
+            dispatches.order_id.fetch(['name', 'pos_reference', 'date_order'])
+
+            bodies = {}
+            missing = dispatches.filtered(lambda d: d.state == 'sent' and not d.body)
+            for lang, group in missing.grouped(lambda d: d.lang or 'da_DK').items():
+                order_bodies = self._render_order_bodies(group.order_id, lang)
+                bodies.update((dispatch.id, order_bodies.get(dispatch.order_id.id)) for dispatch in group)
+
+            for dispatch in dispatches:
+                yield {
+                    'order': dispatch.order_id.name,
+                    'pos_reference': dispatch.order_id.pos_reference or '',
+                    'order_date': fields.Datetime.to_string(dispatch.order_id.date_order),
+                    'point_of_sale': dispatch.config_id.name or '',
+                    'phone': dispatch.phone,
+                    'state': dispatch.state,
+                    'sent_at': fields.Datetime.to_string(dispatch.sent_at) or '',
+                    'attempts': dispatch.attempt_count,
+                    'segments': dispatch.segments,
+                    'encoding': dispatch.encoding or '',
+                    'gateway': dispatch.gateway_id.name or '',
+                    'error': dispatch.error or '',
+                    'body': dispatch.body or bodies.get(dispatch.id) or '',
+                }
+            last_id = dispatches[-1].id
+            self.env.invalidate_all()
+
+    def _get_ui_status(self):
+        """Get the dispatch status reported to the POS."""
+        self.ensure_one()
+        status = {
+            'queued': 'queued',
+            'sending': 'queued',
+            'retry': 'queued',
+            'sent': 'sent',
+            'failed': 'error',
+        }[self.state]
+        result = {'status': status, 'order_id': self.order_id.id, 'dispatch_id': self.id}
+        if status == 'error':
+            result['error'] = self.error
+        return result
+
+    @api.model
+    def _get_queue_cron(self):
+        """Get the cron draining the dispatch queue."""
+        return self._get_cron('ir_cron_pos_sms_receipt_dispatch')
+
+    @api.model
+    def _get_retry_cron(self):
+        """Get the cron resending the failed dispatches."""
+        return self._get_cron('ir_cron_pos_sms_receipt_retry')
+
+    @api.model
+    def _get_cron(self, xml_id):
+        cron_refs = [
+            'odoo-sms-pos-receipt.%s' % xml_id,
+            'pos_sms_receipt.%s' % xml_id
+        ]
+        for cron_ref in cron_refs:
+            cron = self.env.ref(cron_ref, raise_if_not_found=False)
+            if cron:
+                return cron.sudo()
+        return self.env['ir.cron']
+
+    @api.model
+    def _cron_process_queue(self, batch_size=DISPATCH_BATCH_SIZE):
+        """Send one batch of queued SMS receipts, re-triggering while work remains.
+
+        Receipts held back by the rate limiter or an open circuit breaker
+        wait in the queue until their next attempt.
+        """
+        domain = [
+            ('state', '=', 'queued'),
+            '|', ('next_attempt', '=', False), ('next_attempt', '<=', fields.Datetime.now()),
+        ]
+        dispatches = self.search(domain, order='id', limit=batch_size)
+        if not dispatches:
+            return True
+
+        dispatches._send()
+
+        # auto-commit except in testing mode
+        if not getattr(threading.current_thread(), 'testing', False):
+            self.env.cr.commit()
+            if self.search_count(domain, limit=1):
+                self._get_queue_cron()._trigger()
+        return True
+
+    @api.model
+    def _cron_process_retries(self, batch_size=DISPATCH_BATCH_SIZE):
+        """Resend one batch of due retries, re-triggering while due retries remain."""
+        domain = [('state', '=', 'retry'), ('next_attempt', '<=', fields.Datetime.now())]
+        dispatches = self.search(domain, order='next_attempt, id', limit=batch_size)
+        if not dispatches:
+            return True
+
+        dispatches._send()
+
+        # auto-commit except in testing mode
+        if not getattr(threading.current_thread(), 'testing', False):
+            self.env.cr.commit()
+            if self.search_count(domain, limit=1):
+                self._get_retry_cron()._trigger()
+        return True
+
+    @api.model
+    def _cron_apply_retention(self, batch_size=RETENTION_BATCH_SIZE):
+        """Redact the phones of old SMS receipts, then delete the oldest dispatches.
+
+        Rows are handled in batches of ``batch_size`` walked by id, each
+        batch committed on its own, so the POS tables are never locked for
+        long. The redaction resumes after the last id it redacted.
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        now = fields.Datetime.now()
+        redact_days = int(params.get_param(REDACT_DAYS_PARAM, DEFAULT_REDACT_DAYS))
+        retention_days = int(params.get_param(RETENTION_DAYS_PARAM, DEFAULT_RETENTION_DAYS))
+        if redact_days > 0:
+            cutoff = now - timedelta(days=redact_days)
+            self._retention_walk('pos.sms.receipt.dispatch', cutoff, batch_size, self._redact_dispatches)
+            self._retention_walk('pos.order', cutoff, batch_size, self._redact_orders)
+        if retention_days > 0:
+            self._delete_dispatches(now - timedelta(days=retention_days), batch_size)
+        return True
+
+    @api.model
+    def _retention_walk(self, model_name, cutoff, batch_size, process):
+        """Call ``process`` on the records created before ``cutoff``, batch by batch.
+
+        Keyset pagination on the id, from the last id processed by the
+        previous run, which is kept in an ir.config_parameter. Ids growing
+        with the creation date, the walk stops at the first recent record.
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        cursor_key = 'pos_sms_receipt.retention_cursor.%s' % model_name
+        last_id = int(params.get_param(cursor_key, 0))
+        Model = self.env[model_name].sudo().with_context(active_test=False)
+        while True:
+            records = Model.search([('id', '>', last_id)], order='id', limit=batch_size)
+            expired = records
+            # Stop at the first record not expired yet
+            for index, record in enumerate(records):
+                if record.create_date >= cutoff:
+                    expired = records[:index]
+                    break
+            if not expired:
+                return
+            process(expired)
+            last_id = expired[-1].id
+            params.set_param(cursor_key, last_id)
+            self._retention_commit()
+            if len(expired) < len(records) or len(records) < batch_size:
+                return
+
+    @api.model
+    def _redact_dispatches(self, dispatches):
+        """Redact the phones of the dispatches, in their errors too, and delete their SMS records.
+
+        The deduplication keys, hashed from the phones, are cleared as well.
+        """
+        dispatches.fetch(['phone', 'error', 'sms_id'])
+        dispatches.sms_id.unlink()
+        redacted = dispatches.grouped(lambda d: (
+            redact_phone(d.phone),
+            redact_phones_in_text((d.error or '').replace(d.phone, redact_phone(d.phone))) or False,
+        ))
+        for (phone, error), group in redacted.items():
+            group.write({'phone': phone, 'error': error, 'dedup_key': False})
+
+    @api.model
+    def _redact_orders(self, orders):
+        """Redact the phones given for the SMS receipts of the orders."""
+        orders = orders.filtered('phone_for_sms_receipt')
+        for phone, group in orders.grouped(lambda o: redact_phone(o.phone_for_sms_receipt)).items():
+            group.write({'phone_for_sms_receipt': phone})
+
+    @api.model
+    def _delete_dispatches(self, cutoff, batch_size):
+        """Delete the dispatches created before ``cutoff``, oldest first, batch by batch."""
+        while True:
+            dispatches = self.sudo().search([('create_date', '<', cutoff)], order='id', limit=batch_size)
+            if not dispatches:
+                return
+            dispatches.sms_id.unlink()
+            dispatches.unlink()
+            self._retention_commit()
+            if len(dispatches) < batch_size:
+                return
+
+    @api.model
+    def _retention_commit(self):
+        # auto-commit except in testing mode
+        if not getattr(threading.current_thread(), 'testing', False):
+            self.env.cr.commit()
+
+    def _send(self, chunk_size=DISPATCH_BATCH_SIZE):
+        """Send the dispatches in chunks, one gateway call per chunk.
+
+        Dispatches are grouped by gateway account, so each gateway call
+        carries up to ``chunk_size`` receipts of one account. Each chunk
+        takes its send permits from the gateway rate limiter and circuit
+        breaker first; once a chunk is held back, the rest of the dispatches
+        of the gateway are queued instead of being tried. The circuit state
+        is read once, then follows the results recorded by the chunks.
+        """
+        gateway_states = self.env['pos.sms.gateway.state'].sudo()
+        for gateway, dispatches in self.grouped('gateway_id').items():
+            policy = dispatches.config_id._get_sms_gateway_policy()
+            for index in range(0, len(dispatches), chunk_size):
+                chunk = dispatches[index:index + chunk_size]
+                granted, retry_at = gateway_states._acquire(gateway, len(chunk), policy)
+                chunk[:granted]._send_chunk(gateway, policy)
+                if granted < len(chunk):
+                    dispatches[index + granted:]._hold(retry_at)
+                    break
+
+    def _hold(self, retry_at):
+        """Queue the dispatches held back by the gateway until ``retry_at``."""
+        self.write({'state': 'queued', 'next_attempt': retry_at})
+        cron = self._get_queue_cron()
+        if cron:
+            cron._trigger(at=retry_at)
+
+    def _send_chunk(self, gateway, policy):
+        """Render the dispatches, create their SMS records at once and hand them to the gateway in one call.
+
+        The outcome is reported to the circuit breaker of the gateway.
+        """
+        bodies = self._render_bodies()
+        to_send = self.filtered(lambda d: d.id in bodies)
+        if not to_send:
+            return
+
+        with dispatch_metrics.timer('stage_seconds', stage='sms_create'):
+            sms_records = self.env['sms.sms'].sudo().create([{
+                'number': dispatch.phone,
+                'body': bodies[dispatch.id],
+                'state': 'outgoing',
+            } for dispatch in to_send])
+        # A single write per dispatch: status, attempt, SMS and rendered body
+        for dispatch, sms_record in zip(to_send, sms_records):
+            vals = {
+                'state': 'sending',
+                'attempt_count': dispatch.attempt_count + 1,
+                'sms_id': sms_record.id,
+            }
+            if not dispatch.body:
+                vals['body'] = bodies[dispatch.id]
+            dispatch.write(vals)
+
+        gateway_states = self.env['pos.sms.gateway.state'].sudo()
+        if gateway:
+            sms_records = sms_records.with_context(sms_iap_account_id=gateway.id)
+        try:
+            with dispatch_metrics.timer('gateway_seconds', gateway=gateway.name or 'default'):
+                sms_records._send()
+        except Exception as e:
+            error_msg = str(e)
+            if not self._is_compatibility_error(error_msg):
+                _logger.error("Failed to send SMS receipt batch: %s", error_msg)
+                gateway_states._record_result(gateway, False, policy, error_msg)
+                to_send._set_failed(error_msg, retry=True)
+                return
+            _logger.warning("SMS gateway compatibility warning for receipt batch: %s", error_msg)
+            sms_records.invalidate_recordset(['state'])
+
+        failed = to_send.filtered(lambda d: d.sms_id.state == 'error')
+        # Gateway failures only, a bad phone number says nothing about the gateway
+        gateway_failed = failed.filtered(lambda d: d.sms_id.failure_type not in PERMANENT_FAILURE_TYPES)
+        if len(gateway_failed) < len(to_send):
+            gateway_states._record_result(gateway, True, policy)
+        else:
+            gateway_states._record_result(
+                gateway, False, policy,
+                getattr(gateway_failed[:1].sms_id, 'sms_api_error', False) or gateway_failed[:1].sms_id.failure_type
+            )
+        errors = failed.grouped(
+            lambda d: (
+                getattr(d.sms_id, 'sms_api_error', False) or d.sms_id.failure_type or _('Unknown SMS error'),
+                d.sms_id.failure_type not in PERMANENT_FAILURE_TYPES,
+            )
+        )
+        for (error_msg, retry), dispatches in errors.items():
+            dispatches._set_failed(error_msg, retry=retry)
+        (to_send - failed)._set_sent()
+
+    def _render_bodies(self):
+        """Get the stored bodies, rendering missing ones in bulk per language.
+
+        Rendered bodies are stored by the caller along with the dispatch
+        status. Dispatches that cannot be rendered are marked as failed.
+
+        :return: dict {dispatch id: SMS body}
+        """
+        bodies = {dispatch.id: dispatch.body for dispatch in self if dispatch.body}
+        to_render = self.filtered(lambda d: not d.body)
+        for lang, dispatches in to_render.grouped(lambda d: d.lang or 'da_DK').items():
+            order_bodies = self._render_order_bodies(dispatches.order_id, lang)
+            for dispatch in dispatches:
+                if dispatch.order_id.id in order_bodies:
+                    bodies[dispatch.id] = order_bodies[dispatch.order_id.id]
+                else:
+                    dispatch._set_failed(_("The SMS receipt could not be rendered."))
+        return bodies
+
+    def _set_sent(self):
+        """Mark the dispatches as sent."""
+        if not self:
+            return
+        self.write({'state': 'sent', 'error': False, 'next_attempt': False, 'sent_at': fields.Datetime.now()})
+        self._record_metrics('sent_total')
+
+    def _set_failed(self, error_msg, retry=False):
+        """Schedule a retry of the dispatches, or mark them as failed.
+
+        With ``retry``, dispatches with attempts left under the max attempts
+        of their POS wait for a retry with exponential backoff and jitter;
+        the others are marked as failed.
+        """
+        if not self:
+            return
+        to_retry = self.browse()
+        if retry:
+            to_retry = self.filtered(lambda d: d.attempt_count < d.config_id.sms_max_attempts)
+        if to_retry:
+            now = fields.Datetime.now()
+            for dispatch in to_retry:
+                dispatch.write({
+                    'state': 'retry',
+                    'error': error_msg,
+                    'next_attempt': now + timedelta(seconds=self._get_retry_delay(dispatch.attempt_count)),
+                })
+            cron = self._get_retry_cron()
+            if cron:
+                cron._trigger(at=min(to_retry.mapped('next_attempt')))
+            to_retry._record_metrics('retries_total')
+
+        failed = self - to_retry
+        if failed:
+            failed.write({'state': 'failed', 'error': error_msg, 'next_attempt': False})
+            failed._record_metrics('failed_total')
+
+    def _record_metrics(self, counter):
+        """Count the dispatches in the metrics, per gateway and POS."""
+        self.env['pos.sms.receipt.metric']._schedule_flush()
+        now = fields.Datetime.now()
+        for (gateway, config), dispatches in self.grouped(lambda d: (d.gateway_id, d.config_id)).items():
+            labels = {'gateway': gateway.name or 'default', 'pos': config.name or ''}
+            dispatch_metrics.inc(counter, len(dispatches), **labels)
+            if counter == 'sent_total':
+                dispatch_metrics.inc('segments_total', sum(dispatches.mapped('segments')), **labels)
+                for dispatch in dispatches:
+                    dispatch_metrics.observe(
+                        'delivery_seconds', (now - dispatch.create_date).total_seconds(), **labels
+                    )
+
+    @api.model
+    def _get_retry_delay(self, attempt_count):
+        """Get the delay in seconds before the next attempt, doubling after each attempt."""
+        delay = min(RETRY_BASE_DELAY * 2 ** max(attempt_count - 1, 0), RETRY_MAX_DELAY)
+        # Jitter spreads the retries of receipts that failed together
+        return delay * (1 + random.uniform(-RETRY_JITTER, RETRY_JITTER))
+
+    @api.model
+    def _is_compatibility_error(self, error_msg):
+        """Check if the error is a known gateway compatibility issue."""
+        return any(all(part in error_msg for part in parts) for parts in COMPATIBILITY_ERRORS)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, tools, SUPERUSER_ID
+import json
+import logging
+
+from ..tools.metrics import dispatch_metrics, render_prometheus
+
+_logger = logging.getLogger(__name__)
+
+
+class PosSmsReceiptMetric(models.Model):
+    """SMS receipt dispatch metrics of all the workers, one row per series.
+
+    Each worker counts in memory, then adds its counts to these rows once
+    its transaction is committed, so HTTP and cron workers alike feed the
+    metrics exported by any of them.
+    """
+    _name = 'pos.sms.receipt.metric'
+    _description = 'POS SMS Receipt Metric'
+    _log_access = False
+    _order = 'name, labels'
+
+    name = fields.Char(
+        string="Series",
+        required=True,
+        readonly=True
+    )
+    labels = fields.Char(
+        string="Labels",
+        required=True,
+        readonly=True,
+        help="Labels of the series, as a JSON list of [name, value] pairs."
+    )
+    value = fields.Float(
+        string="Value",
+        readonly=True
+    )
+
+    def init(self):
+        tools.create_unique_index(
+            self._cr, 'pos_sms_receipt_metric_series_uniq', self._table, ['name', 'labels']
+        )
+
+    @api.model
+    def _schedule_flush(self):
+        """Store the counts of this worker once the transaction is committed, in a transaction of their own."""
+        postcommit = self.env.cr.postcommit
+        if postcommit.data.get('pos_sms_receipt_metrics'):
+            return
+        postcommit.data['pos_sms_receipt_metrics'] = True
+        registry = self.env.registry
+
+        @postcommit.add
+        def flush():
+            try:
+                with registry.cursor() as cr:
+                    api.Environment(cr, SUPERUSER_ID, {})['pos.sms.receipt.metric']._flush()
+            except Exception:
+                _logger.exception("Failed to store the SMS receipt metrics")
+
+    @api.model
+    def _flush(self):
+        """Add the counts of this worker to the stored series."""
+        counts = dispatch_metrics.drain()
+        if not counts:
+            return
+        # Rows locked in the same order by every worker
+        rows = sorted((name, json.dumps(labels), value) for (name, labels), value in counts.items())
+        try:
+            self.env.cr.execute("""
+                INSERT INTO pos_sms_receipt_metric (name, labels, value)
+                VALUES %s
+                ON CONFLICT (name, labels) DO UPDATE
+                   SET value = pos_sms_receipt_metric.value + EXCLUDED.value
+            """ % ', '.join(['(%s, %s, %s)'] * len(rows)), [param for row in rows for param in row])
+        except Exception:
+            dispatch_metrics.restore(counts)
+            raise
+
+    @api.model
+    def _render_prometheus(self):
+        """Export the metrics of all the workers in the Prometheus text format."""
+        self.env.cr.execute("SELECT name, labels, value FROM pos_sms_receipt_metric")
+        return render_prometheus({
+            (name, tuple(tuple(pair) for pair in json.loads(labels))): value
+            for name, labels, value in self.env.cr.fetchall()
+        })
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+
+from ..tools.phone_numbers import normalize_e164
+
+
+class ResPartner(models.Model):
+    _inherit = 'res.partner'
+
+    sms_phone_e164 = fields.Char(
+        string="SMS Phone (E.164)",
+        compute='_compute_sms_phone_e164',
+        store=True,
+        index=True,
+        help="Mobile, or else phone, of the contact in E.164 format, used to "
+             "send SMS receipts."
+    )
+
+    @api.depends('mobile', 'phone', 'country_id.phone_code', 'company_id.country_id.phone_code')
+    def _compute_sms_phone_e164(self):
+        default_country = self.env.company.country_id
+        for partner in self:
+            country = partner.country_id or partner.company_id.country_id or default_country
+            partner.sms_phone_e164 = (
+                normalize_e164(partner.mobile, country.phone_code)
+                or normalize_e164(partner.phone, country.phone_code)
+            )
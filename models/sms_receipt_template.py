@@ -1,5 +1,78 @@
 # -*- coding: utf-8 -*-
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import ValidationError
+
+from ..tools.receipt_renderer import (
+    SECTION_VARIABLES, ReceiptRenderer, TemplateError, compile_template, validate_template,
+)
+from ..tools.sms_segments import ReceiptCompactor
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Template fields and the section whose variables they may use
+TEMPLATE_SECTIONS = {
+    'company_info_template': 'company_info',
+    'separator_line': 'separator',
+    'order_info_template': 'order_info',
+    'item_line_template': 'items',
+    'total_template': 'total',
+    'tax_template': 'tax',
+    'tax_line_template': 'tax_line',
+    'customer_template': 'customer',
+    'footer_template': 'footer',
+    'link_message_template': 'link_message',
+}
+
+# Sample order shown by the template preview, by section
+PREVIEW_VALUES = {
+    'company_info': {
+        'company_name': "Your Company Name",
+        'phone_line': "Telefon: +45 12 34 56 78",
+        'vat_line': "CVR: 12345678",
+        'email_line': "info@company.dk",
+        'website_line': "https://company.dk",
+    },
+    'separator': {},
+    'order_info': {
+        'served_by_line': "Betjent af John Doe",
+        'order_name': "Shop/001",
+        'order_date': "29-07-2025 08:30",
+    },
+    'items': [
+        {'product_name': "Product 1", 'qty': "2", 'price': "50.00"},
+        {'product_name': "Product 2", 'qty': "1", 'price': "25.00"},
+    ],
+    'total': {
+        'total': "75.00",
+        'payment_method': "Kontant",
+        'amount': "80.00",
+        'change': "5.00",
+    },
+    'tax': {
+        'tax_lines': [
+            {'tax_rate': "25%", 'tax_name': "Moms 25%", 'tax_amount': "12.50",
+             'tax_base': "50.00", 'total': "62.50"},
+            {'tax_rate': "0%", 'tax_name': "Momsfri", 'tax_amount': "0.00",
+             'tax_base': "12.50", 'total': "12.50"},
+        ],
+        'tax_amount': "12.50",
+        'tax_base': "62.50",
+        'total': "75.00",
+    },
+    'customer': {'customer_name': "Jane Smith"},
+    'footer': {
+        'website_line': "Du kan gå til https://company.dk og brug koden nedenfor",
+        'unique_code': "Shop/001",
+        'order_name': "Shop/001",
+        'order_datetime': "29-07-2025 08:30:15",
+    },
+    'link_message': {
+        'company_name': "Your Company Name",
+        'order_name': "Shop/001",
+        'receipt_url': "https://company.dk/pos_sms_receipt/r/AbCdEf123456",
+    },
+}
 
 
 class SmsReceiptTemplate(models.Model):
@@ -121,8 +194,16 @@ BYTTEPENGE
     tax_template = fields.Text(
         string="Tax Section Template",
         default="""Moms    Beløb    Basis      I alt
-25%     {tax_amount}    {tax_base}    {total}""",
-        help="Available variables: {tax_amount}, {tax_base}, {total}",
+{tax_lines}""",
+        help="Available variables: {tax_lines}, {tax_amount}, {tax_base}, {total}",
+        translate=True
+    )
+
+    tax_line_template = fields.Char(
+        string="Tax Line Template",
+        default="{tax_rate}     {tax_amount}    {tax_base}    {total}",
+        help="Line repeated per tax rate of the order in {tax_lines}. "
+             "Available variables: {tax_rate}, {tax_name}, {tax_amount}, {tax_base}, {total}",
         translate=True
     )
     
@@ -155,6 +236,70 @@ Ordre {order_name}
         translate=True
     )
     
+    # Delivery mode - full receipt in the SMS, or a short link to a web receipt
+    delivery_mode = fields.Selection(
+        selection=[
+            ('full', 'Full Receipt'),
+            ('link', 'Receipt Link'),
+        ],
+        string="Delivery Mode",
+        default='full',
+        required=True,
+        help="Full Receipt sends the rendered receipt in the SMS. Receipt Link "
+             "sends a short message with a private link to the receipt, so the "
+             "SMS size does not depend on the number of items."
+    )
+
+    link_message_template = fields.Char(
+        string="Link Message Template",
+        default="Din kvittering fra {company_name}: {receipt_url}",
+        help="Available variables: {company_name}, {order_name}, {receipt_url}",
+        translate=True
+    )
+
+    link_validity_days = fields.Integer(
+        string="Link Validity (Days)",
+        default=90,
+        help="Number of days the receipt link stays valid."
+    )
+
+    # Compaction - applied after rendering to meet a segment budget
+    sms_segment_budget = fields.Integer(
+        string="Segment Budget",
+        default=0,
+        help="Target number of billed SMS segments per receipt. When a receipt "
+             "is longer, the enabled compaction strategies are applied until it "
+             "fits. 0 disables the budget."
+    )
+
+    compact_whitespace = fields.Boolean(
+        string="Collapse Whitespace",
+        default=False,
+        help="Collapse runs of spaces and blank lines used for alignment."
+    )
+
+    compact_transliterate = fields.Boolean(
+        string="Transliterate to GSM-7",
+        default=False,
+        help="Replace characters outside the GSM-7 alphabet (e.g. curly quotes, "
+             "dashes, accented letters) so the receipt is not sent as UCS-2, "
+             "which holds less than half the characters per segment."
+    )
+
+    compact_truncate_items = fields.Boolean(
+        string="Truncate Item List",
+        default=False,
+        help="Keep only the first items and add a \"+N more\" line when the "
+             "receipt exceeds the segment budget."
+    )
+
+    compact_drop_sections = fields.Boolean(
+        string="Drop Optional Sections",
+        default=False,
+        help="Drop the separator, tax, customer, company, footer and order "
+             "sections, in that order, when the receipt exceeds the segment budget."
+    )
+
     # Preview functionality
     preview_text = fields.Text(
         string="Preview",
@@ -163,86 +308,119 @@ Ordre {order_name}
     )
     
     @api.depends('company_info_template', 'order_info_template', 'item_line_template', 
-                 'total_template', 'tax_template', 'customer_template', 'footer_template',
+                 'total_template', 'tax_template', 'tax_line_template', 'customer_template', 'footer_template',
                  'show_company_info', 'show_order_info', 'show_items', 'show_total', 
-                 'show_tax', 'show_customer', 'show_footer', 'separator_line')
+                 'show_tax', 'show_customer', 'show_footer', 'separator_line',
+                 'delivery_mode', 'link_message_template', 'sms_segment_budget', 'compact_whitespace',
+                 'compact_transliterate', 'compact_truncate_items', 'compact_drop_sections')
     def _compute_preview(self):
-        """Generate a preview of the SMS receipt template."""
+        """Generate a preview of the SMS receipt template with the renderer used for sending."""
         for record in self:
-            preview = ""
-            
-            if record.show_company_info and record.company_info_template:
-                preview += record.company_info_template.format(
-                    company_name="Your Company Name",
-                    phone_line="Telefon: +45 12 34 56 78",
-                    vat_line="CVR: 12345678",
-                    email_line="info@company.dk",
-                    website_line="https://company.dk"
-                ) + "\n"
-            
-            if record.show_separator and record.separator_line:
-                preview += record.separator_line + "\n"
-            
-            if record.show_order_info and record.order_info_template:
-                preview += record.order_info_template.format(
-                    served_by_line="Betjent af John Doe",
-                    order_name="Shop/001",
-                    order_date="29-07-2025 08:30"
-                ) + "\n\n"
-            
-            if record.show_items and record.item_line_template:
-                preview += record.item_line_template.format(
-                    product_name="Product 1",
-                    qty="2",
-                    price="50.00"
-                ) + "\n"
-                preview += record.item_line_template.format(
-                    product_name="Product 2",
-                    qty="1",
-                    price="25.00"
-                ) + "\n"
-            
-            if record.show_total and record.total_template:
-                # Create a safe template formatting function
-                template_vars = {
-                    'total': "75.00",
-                    'payment_method': "Kontant",
-                    'amount': "80.00",
-                    'change': "5.00"
-                }
-                
-                try:
-                    # Try to format with all variables
-                    total_preview = record.total_template
-                    for var, value in template_vars.items():
-                        total_preview = total_preview.replace('{' + var + '}', str(value))
-                    preview += total_preview + "\n"
-                except Exception:
-                    # Ultimate fallback - just show the template as-is
-                    preview += record.total_template + "\n"
-            
-            if record.show_tax and record.tax_template:
-                preview += record.tax_template.format(
-                    tax_amount="15.00",
-                    tax_base="60.00",
-                    total="75.00"
-                ) + "\n"
-            
-            if record.show_customer and record.customer_template:
-                preview += record.customer_template.format(
-                    customer_name="Jane Smith"
-                ) + "\n"
-            
-            if record.show_footer and record.footer_template:
-                preview += "\n" + record.footer_template.format(
-                    website_line="Du kan gå til https://company.dk og brug koden nedenfor",
-                    unique_code="Shop/001",
-                    order_name="Shop/001",
-                    order_datetime="29-07-2025 08:30:15"
-                )
-            
-            record.preview_text = preview
-    
+            try:
+                if record.delivery_mode == 'link':
+                    render = compile_template(record.link_message_template or '')
+                    record.preview_text = render(PREVIEW_VALUES['link_message'])
+                    continue
+                renderer = ReceiptRenderer(record._get_section_templates(), record._get_receipt_compactor())
+                record.preview_text = renderer.render_sms(PREVIEW_VALUES)
+            except TemplateError as e:
+                record.preview_text = _("The template is not valid: %s", e)
+
+    @api.constrains(*TEMPLATE_SECTIONS)
+    def _check_section_templates(self):
+        """Reject templates using unknown variables, so they never fail at send time."""
+        for record in self:
+            for field_name in TEMPLATE_SECTIONS:
+                record._validate_section_template(field_name, record[field_name])
+
+    def _validate_section_template(self, field_name, template):
+        if not template:
+            return
+        try:
+            validate_template(template, SECTION_VARIABLES[TEMPLATE_SECTIONS[field_name]])
+        except TemplateError as e:
+            raise ValidationError(_(
+                "The %(template)s is not valid: %(error)s",
+                template=self._fields[field_name].string,
+                error=e,
+            ))
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        templates = super().create(vals_list)
+        # New templates change the template resolution map
+        self.env.registry.clear_cache()
+        return templates
+
+    def write(self, vals):
+        res = super().write(vals)
+        # Drop compiled renderers of the modified templates, and the
+        # resolution map when templates are archived or re-languaged
+        self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
+
+    def update_field_translations(self, field_name, translations):
+        if field_name in TEMPLATE_SECTIONS:
+            for translation in translations.values():
+                # Translations of the terms of a template come as {term: value}
+                values = translation.values() if isinstance(translation, dict) else [translation]
+                for value in values:
+                    self._validate_section_template(field_name, value)
+        # Translations are not reflected in write_date, the renderer cache key
+        res = super().update_field_translations(field_name, translations)
+        self.env.registry.clear_cache()
+        return res
+
+    def _get_section_templates(self):
+        """Get the templates of the enabled sections, by section name."""
+        self.ensure_one()
+        return {
+            'company_info': self.show_company_info and self.company_info_template,
+            'separator': self.show_separator and self.separator_line,
+            'order_info': self.show_order_info and self.order_info_template,
+            'items': self.show_items and self.item_line_template,
+            'total': self.show_total and self.total_template,
+            'tax': self.show_tax and self.tax_template,
+            'tax_line': self.show_tax and self.tax_line_template,
+            'customer': self.show_customer and self.customer_template,
+            'footer': self.show_footer and self.footer_template,
+        }
+
+    def _get_receipt_compactor(self):
+        """Get the compactor of the enabled strategies, or None when none is enabled."""
+        self.ensure_one()
+        if not (self.compact_whitespace or self.compact_transliterate
+                or (self.sms_segment_budget and (self.compact_truncate_items or self.compact_drop_sections))):
+            return None
+        return ReceiptCompactor(
+            budget=self.sms_segment_budget,
+            whitespace=self.compact_whitespace,
+            transliterate=self.compact_transliterate,
+            truncate_items=self.compact_truncate_items,
+            drop_sections=self.compact_drop_sections,
+            more_label=_("+%s more"),
+        )
+
+    def _get_receipt_renderer(self):
+        """Get the compiled receipt renderer of the template in the current language."""
+        self.ensure_one()
+        if not self.id:
+            # Unsaved fallback template, nothing to cache it by
+            return ReceiptRenderer(self._get_section_templates(), self._get_receipt_compactor())
+        return self._get_compiled_receipt_renderer(self.id, self.write_date, self.env.lang)
+
+    @api.model
+    @tools.ormcache('template_id', 'write_date', 'lang')
+    def _get_compiled_receipt_renderer(self, template_id, write_date, lang):
+        """Compile a template once per worker, keyed by (template id, write_date, language)."""
+        template = self.browse(template_id).with_context(lang=lang)
+        return ReceiptRenderer(template._get_section_templates(), template._get_receipt_compactor())
+
     def action_preview(self):
         """Force recompute of preview."""
         self._compute_preview()
@@ -339,7 +517,8 @@ Ordre {order_name}
                 'show_total': True,
                 'total_template': f'--------\n{lang_data["total_label"]}                {lang_data["currency"]} {{total}}\n\n{{payment_method}}          {{amount}}\n\n{lang_data["change_label"]}\n                     {lang_data["currency"]} {{change}}',
                 'show_tax': True,
-                'tax_template': f'{lang_data["tax_header"]}\n25%     {{tax_amount}} {lang_data["currency"]}  {{tax_base}} {lang_data["currency"]}  {{total}} {lang_data["currency"]}',
+                'tax_template': f'{lang_data["tax_header"]}\n{{tax_lines}}',
+                'tax_line_template': f'{{tax_rate}}     {{tax_amount}} {lang_data["currency"]}  {{tax_base}} {lang_data["currency"]}  {{total}} {lang_data["currency"]}',
                 'show_customer': True,
                 'customer_template': f'{lang_data["customer_prefix"]} {{customer_name}}',
                 'show_footer': True,
@@ -371,51 +550,52 @@ Ordre {order_name}
         
         return templates
 
+    @api.model
+    @tools.ormcache()
+    def _get_template_resolution_map(self):
+        """Map (company id, language) to the id of the template to use.
+
+        Built with one grouped query over the active templates. Besides the
+        exact (company id, language) keys, the map holds the fallback keys
+        (company id, None), (None, language) and (None, None), each resolved
+        to the lowest template id like the former ``search(limit=1)`` chain.
+        """
+        groups = self.sudo()._read_group(
+            [('active', '=', True)],
+            groupby=['company_id', 'language'],
+            aggregates=['id:min'],
+        )
+        resolution = {}
+        for company, language, template_id in sorted(groups, key=lambda group: group[2]):
+            for key in ((company.id, language), (company.id, None), (None, language), (None, None)):
+                resolution.setdefault(key, template_id)
+        return resolution
+
     @api.model
     def get_default_template(self, company_id=None, language=None):
         """Get the default SMS receipt template for a company and language."""
         if not company_id:
             company_id = self.env.company.id
-        
+
         if not language:
             language = self.env.context.get('lang', 'da_DK')
-            
-        # First try to find template for specific company and language
-        template = self.search([
-            ('company_id', '=', company_id),
-            ('language', '=', language),
-            ('active', '=', True)
-        ], limit=1)
-        
-        if not template:
-            # Try to find template for company with any language
-            template = self.search([
-                ('company_id', '=', company_id),
-                ('active', '=', True)
-            ], limit=1)
-            
-        if not template:
-            # Try to find template for specific language with any company
-            template = self.search([
-                ('language', '=', language),
-                ('active', '=', True)
-            ], limit=1)
-            
-        if not template:
-            # Try to find any active template
-            template = self.search([('active', '=', True)], limit=1)
-            
-        if not template:
-            # Create default templates if none exist
-            templates = self.create_default_templates()
-            template = templates[0] if templates else None
-            
-        if not template:
-            # Last resort: create a simple template
-            template = self.create({
-                'name': _('Default SMS Receipt'),
-                'company_id': company_id,
-                'language': language
-            })
-        
-        return template
\ No newline at end of file
+
+        # Specific company and language, then company with any language,
+        # then language with any company, then any active template
+        resolution = self._get_template_resolution_map()
+        for key in ((company_id, language), (company_id, None), (None, language), (None, None)):
+            template_id = resolution.get(key)
+            if template_id:
+                return self.browse(template_id)
+
+        # No active template at all: render with the default sections rather
+        # than creating templates inside the caller's transaction
+        _logger.warning(
+            "No active SMS receipt template found for company %s, using default template",
+            company_id
+        )
+        return self.new({
+            'name': _('Default SMS Receipt'),
+            'company_id': company_id,
+            'language': language
+        })
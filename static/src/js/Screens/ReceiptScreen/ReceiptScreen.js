@@ -4,8 +4,10 @@ import { ReceiptScreen } from "@point_of_sale/app/screens/receipt_screen/receipt
 import { patch } from "@web/core/utils/patch";
 import { useService } from "@web/core/utils/hooks";
 import { _t } from "@web/core/l10n/translation";
+import { onWillUnmount } from "@odoo/owl";
 
-
+const PHONE_SEPARATORS_REGEX = /[\s\-().\/]/g;
+const PHONE_REGEX = /^(\+|00)?\d{7,15}$/;
 
 patch(ReceiptScreen.prototype, {
     setup() {
@@ -15,9 +17,24 @@ patch(ReceiptScreen.prototype, {
         this.notification = useService("notification");
         this.popup = useService("popup");
         this.orm = useService("orm");
+        this.smsOutbox = useService("pos_sms_outbox");
+
+        // Follow the background sending of this order's SMS receipt
+        const unsubscribe = this.smsOutbox.onResult(this.onSmsOutboxResult.bind(this));
+        onWillUnmount(unsubscribe);
         
         // Initialize SMS phone number safely
         this.initializeSmsPhone();
+
+        // Show the rejection of an SMS receipt requested earlier for this order
+        const order = this.currentOrder;
+        if (order) {
+            this.smsOutbox.getEntry(order.name).then((entry) => {
+                if (entry && entry.status === "failed") {
+                    this.onSmsOutboxResult(entry.reference, { status: "error", error: entry.error });
+                }
+            });
+        }
     },
 
     initializeSmsPhone() {
@@ -75,9 +92,10 @@ patch(ReceiptScreen.prototype, {
             return;
         }
 
-        // Basic phone validation
-        const phoneRegex = /^[+]?[\d\s\-\(\)]{7,}$/;
-        if (!phoneRegex.test(phone)) {
+        // Only catches obvious typos: the server normalizes the number with
+        // the company calling code and is the one deciding, its rejection
+        // comes back through the outbox entry status
+        if (!PHONE_REGEX.test(phone.replace(PHONE_SEPARATORS_REGEX, ""))) {
             this.orderUiState.smsSuccessful = false;
             this.orderUiState.smsNotice = _t("The entered phone number format is not valid.");
             return;
@@ -87,82 +105,45 @@ patch(ReceiptScreen.prototype, {
         this.orderUiState.isSmsSending = true;
 
         try {
-            let orderId = order.backendId || order.server_id || order.id;
-            
-            // If order doesn't exist in backend yet (offline mode), create it first
-            if (!orderId) {
-                // Check if we're online before attempting to create order
-                if (!navigator.onLine) {
-                    this.orderUiState.smsSuccessful = false;
-                    this.orderUiState.smsNotice = _t("Cannot send SMS while offline. Please connect to internet and try again.");
-                    return;
-                }
-                
-                // Save the order to backend first
-                try {
-                    const orderData = order.export_as_JSON();
-                    orderData.phone_for_sms_receipt = phone; // Add phone number to order data
-                    
-                    const createdOrder = await this.orm.call(
-                        'pos.order',
-                        'create_from_ui_with_sms',
-                        [[orderData], phone]
-                    );
-                    
-                    if (createdOrder && createdOrder.length > 0) {
-                        orderId = createdOrder[0].id;
-                        order.backendId = orderId; // Store for future reference
-                    } else {
-                        throw new Error("Failed to create order in backend");
-                    }
-                } catch (createError) {
-                    this.orderUiState.smsSuccessful = false;
-                    
-                    // Check if it's a connection error
-                    if (createError.message && createError.message.includes('network')) {
-                        this.orderUiState.smsNotice = _t("Network error. Please check your connection and try again.");
-                    } else {
-                        this.orderUiState.smsNotice = _t("Failed to save order to backend for SMS sending.");
-                    }
-                    return;
-                }
-            }
-            const result = await this.orm.call(
-                'pos.order',
-                'action_send_sms_receipt_rpc',
-                [orderId, phone]
-            );
-
-            if (result === true) {
-                this.orderUiState.smsSuccessful = true;
-                this.orderUiState.smsNotice = _t("SMS receipt sent successfully to %s.", phone);
-                order.is_sms_receipt_sent = true;
-                // Store phone number in order for future reference
-                order.phone_for_sms_receipt = phone;
-            } else if (result && result.error) {
-                this.orderUiState.smsSuccessful = false;
-                this.orderUiState.smsNotice = _t("SMS Sending Failed: %s", result.error);
+            // Store the request locally; the outbox syncs the order if needed
+            // and sends the receipt in one background call, so the cashier
+            // never waits on the network
+            const orderData = order.server_id
+                ? null
+                : { id: order.uid, data: order.export_as_JSON(), to_invoice: order.is_to_invoice() };
+            await this.smsOutbox.add(order.name, phone, orderData);
+            order.phone_for_sms_receipt = phone;
+
+            this.orderUiState.smsSuccessful = true;
+            if (navigator.onLine) {
+                this.orderUiState.smsNotice = _t("SMS receipt queued for sending to %s.", phone);
             } else {
-                this.orderUiState.smsSuccessful = false;
-                this.orderUiState.smsNotice = _t("An unknown error occurred while sending the SMS.");
+                this.orderUiState.smsNotice = _t("You are offline. The SMS receipt will be sent to %s once the connection is back.", phone);
             }
-
+            this.smsOutbox.flush();
         } catch (error) {
-            let errorMessage = _t("Could not connect to the server or an unexpected error occurred.");
-            
-            if (error.data && error.data.message) {
-                errorMessage = error.data.message;
-            } else if (error.message) {
-                errorMessage = error.message;
-            }
-            
             this.orderUiState.smsSuccessful = false;
-            this.orderUiState.smsNotice = errorMessage;
+            this.orderUiState.smsNotice = _t("Could not store the SMS receipt request.");
         } finally {
             // Clear loading state
             this.orderUiState.isSmsSending = false;
         }
     },
 
+    onSmsOutboxResult(reference, result) {
+        const order = this.currentOrder;
+        if (!order || order.name !== reference || !this.orderUiState) {
+            return;
+        }
+        if (result.status === "sent") {
+            this.orderUiState.smsSuccessful = true;
+            this.orderUiState.smsNotice = _t("SMS receipt sent successfully to %s.", order.phone_for_sms_receipt);
+            order.is_sms_receipt_sent = true;
+        } else if (result.status === "error") {
+            this.orderUiState.smsSuccessful = false;
+            this.orderUiState.smsNotice = _t("SMS Sending Failed: %s", result.error);
+        }
+    },
+
 
 });
@@ -0,0 +1,210 @@
+/* @odoo-module */
+
+import { registry } from "@web/core/registry";
+
+const DB_NAME = "pos_sms_receipt";
+const DB_VERSION = 1;
+const STORE_NAME = "outbox";
+
+// Background flush interval and retry backoff bounds (milliseconds)
+const FLUSH_INTERVAL = 30000;
+const RETRY_BASE_DELAY = 5000;
+const RETRY_MAX_DELAY = 600000;
+// How long entries rejected by the server are kept for the cashier to see
+const FAILED_ENTRY_LIFETIME = 86400000;
+
+/**
+ * Persistent outbox of SMS receipts requested at the POS.
+ *
+ * Entries (order reference, phone) are stored in IndexedDB as soon as the
+ * cashier asks for the SMS, and flushed to the backend in one batched RPC
+ * in the background. Entries of orders not synced yet carry the order data,
+ * so the same RPC syncs the order and sends its receipt. Entries whose flush
+ * failed are retried later with exponential backoff, so receipts requested
+ * while offline are not lost. Entries the server rejected (e.g. a phone
+ * number it cannot normalize) are not retried: they stay in the outbox with
+ * the "failed" status and the server's error until the cashier sends the
+ * receipt again.
+ */
+export class SmsOutbox {
+    constructor(orm) {
+        this.orm = orm;
+        this.dbPromise = null;
+        this.memoryStore = new Map();
+        this.flushPromise = null;
+        this.listeners = new Set();
+    }
+
+    start() {
+        this.interval = setInterval(() => this.flush(), FLUSH_INTERVAL);
+        window.addEventListener("online", () => this.flush());
+        this.flush();
+    }
+
+    /**
+     * Register a callback called with (reference, result) for each flushed entry.
+     */
+    onResult(callback) {
+        this.listeners.add(callback);
+        return () => this.listeners.delete(callback);
+    }
+
+    /**
+     * @param {string} reference POS reference of the order
+     * @param {string} phone
+     * @param {Object} [order] UI order data, for orders not synced yet
+     */
+    async add(reference, phone, order = null) {
+        await this._put({
+            reference,
+            phone,
+            order,
+            status: "pending",
+            error: "",
+            attempts: 0,
+            nextAttempt: 0,
+            createdAt: Date.now(),
+        });
+    }
+
+    /**
+     * @param {string} reference POS reference of the order
+     * @returns {Promise<Object|undefined>} the stored entry of the order, if any
+     */
+    async getEntry(reference) {
+        return (await this._getAll()).find((entry) => entry.reference === reference);
+    }
+
+    /**
+     * Send all due entries in one RPC; concurrent calls share the running flush.
+     */
+    flush() {
+        if (!this.flushPromise) {
+            this.flushPromise = this._flush().finally(() => {
+                this.flushPromise = null;
+            });
+        }
+        return this.flushPromise;
+    }
+
+    async _flush() {
+        if (!navigator.onLine) {
+            return {};
+        }
+        const now = Date.now();
+        const entries = [];
+        for (const entry of await this._getAll()) {
+            if (entry.status !== "failed") {
+                if (entry.nextAttempt <= now) {
+                    entries.push(entry);
+                }
+            } else if (entry.failedAt + FAILED_ENTRY_LIFETIME <= now) {
+                await this._delete(entry.reference);
+            }
+        }
+        if (!entries.length) {
+            return {};
+        }
+
+        let results;
+        try {
+            results = await this.orm.call("pos.order", "send_sms_receipts_from_ui", [
+                entries.map((entry) => ({
+                    reference: entry.reference,
+                    phone: entry.phone,
+                    order: entry.order,
+                })),
+            ]);
+        } catch {
+            // Network or server error: retry every entry later
+            await Promise.all(entries.map((entry) => this._retryLater(entry)));
+            return {};
+        }
+
+        for (const entry of entries) {
+            const result = results[entry.reference] || { status: "pending" };
+            if (result.status === "pending") {
+                // Order not synced yet and no order data to sync it
+                await this._retryLater(entry);
+            } else if (result.status === "error") {
+                // Rejected by the server: keep its answer, sending again is useless
+                await this._put({ ...entry, status: "failed", error: result.error, failedAt: Date.now() });
+            } else {
+                await this._delete(entry.reference);
+            }
+            for (const listener of this.listeners) {
+                listener(entry.reference, result);
+            }
+        }
+        return results;
+    }
+
+    async _retryLater(entry) {
+        const attempts = entry.attempts + 1;
+        const delay = Math.min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY);
+        // Jitter spreads the retries of tills coming back online together
+        const jitter = Math.random() * delay * 0.2;
+        await this._put({ ...entry, attempts, nextAttempt: Date.now() + delay + jitter });
+    }
+
+    // IndexedDB storage, falling back to memory when it is not available
+
+    _getDb() {
+        if (!this.dbPromise) {
+            this.dbPromise = new Promise((resolve) => {
+                if (!window.indexedDB) {
+                    resolve(null);
+                    return;
+                }
+                const request = window.indexedDB.open(DB_NAME, DB_VERSION);
+                request.onupgradeneeded = () => {
+                    request.result.createObjectStore(STORE_NAME, { keyPath: "reference" });
+                };
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => resolve(null);
+            });
+        }
+        return this.dbPromise;
+    }
+
+    async _request(mode, callback) {
+        const db = await this._getDb();
+        if (!db) {
+            return callback(null);
+        }
+        return new Promise((resolve, reject) => {
+            const store = db.transaction(STORE_NAME, mode).objectStore(STORE_NAME);
+            const request = callback(store);
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    async _getAll() {
+        const result = await this._request("readonly", (store) => store && store.getAll());
+        return result || [...this.memoryStore.values()];
+    }
+
+    async _put(entry) {
+        const stored = await this._request("readwrite", (store) => store && store.put(entry));
+        if (stored == null) {
+            this.memoryStore.set(entry.reference, entry);
+        }
+    }
+
+    async _delete(reference) {
+        this.memoryStore.delete(reference);
+        await this._request("readwrite", (store) => store && store.delete(reference));
+    }
+}
+
+export const smsOutboxService = {
+    dependencies: ["orm"],
+    start(env, { orm }) {
+        const outbox = new SmsOutbox(orm);
+        outbox.start();
+        return outbox;
+    },
+};
+
+registry.category("services").add("pos_sms_outbox", smsOutboxService);
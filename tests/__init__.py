@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+from . import test_sms_receipt_performance
+from . import test_sms_receipt_benchmark
+from . import test_sms_receipt_dispatch
+from . import test_sms_receipt_retry
+from . import test_sms_receipt_template
+from . import test_sms_receipt_tools
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch
+import time
+
+from odoo.addons.point_of_sale.tests.common import TestPoSCommon
+from odoo.addons.sms.tools.sms_api import SmsApi
+
+
+class MockSmsGateway:
+    """Local stand-in for the SMS gateway, recording the calls it receives.
+
+    :param latency: seconds each gateway call takes, to simulate a slow provider
+    :param failing_numbers: numbers the gateway rejects as badly formatted
+    :param down: answer every call with a server error
+    """
+
+    def __init__(self, latency=0.0, failing_numbers=(), down=False):
+        self.latency = latency
+        self.failing_numbers = set(failing_numbers)
+        self.down = down
+        self.calls = 0
+        self.messages = []
+
+    def send_sms_batch(self, messages, *args, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        results = []
+        for message in messages:
+            for number in message['numbers']:
+                self.messages.append((number['number'], message['content']))
+                if self.down:
+                    state = 'server_error'
+                elif number['number'] in self.failing_numbers:
+                    state = 'wrong_number_format'
+                else:
+                    state = 'success'
+                results.append({'uuid': number['uuid'], 'state': state, 'credit': 1})
+        return results
+
+
+class SmsReceiptCommon(TestPoSCommon):
+    """POS session with SMS receipts enabled, sending through a mock gateway."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.config = cls.basic_config
+        cls.config.write({
+            'enable_sms_receipt': True,
+            'sms_dispatch_mode': 'immediate',
+            'sms_max_attempts': 3,
+        })
+        cls.env.company.country_id = cls.env.ref('base.dk')
+        cls.sms_products = [
+            cls.create_product('SMS Product %s' % index, cls.categ_basic, 10.0 + index)
+            for index in range(50)
+        ]
+        cls.template = cls.env['sms.receipt.template'].get_default_template(
+            company_id=cls.env.company.id,
+            language=cls.env.context.get('lang', 'da_DK'),
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.gateway = MockSmsGateway()
+        self.startPatcher(patch.object(
+            SmsApi, '_send_sms_batch',
+            lambda api, messages, *args, **kwargs: self.gateway.send_sms_batch(messages, *args, **kwargs)
+        ))
+        self.open_new_session()
+
+    def create_orders(self, count, items=5, phone=False):
+        """Sync ``count`` paid orders of ``items`` lines from the UI."""
+        ui_orders = []
+        for index in range(count):
+            lines = [(self.sms_products[(index + line) % len(self.sms_products)], 1) for line in range(items)]
+            ui_order = self.create_ui_order_data(lines)
+            if phone:
+                ui_order['data']['phone_for_sms_receipt'] = phone
+            ui_orders.append(ui_order)
+        created = self.env['pos.order'].create_from_ui(ui_orders)
+        return self.env['pos.order'].browse([order['id'] for order in created])
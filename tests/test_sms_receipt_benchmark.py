@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import tagged
+import logging
+import time
+
+from .common import SmsReceiptCommon
+
+_logger = logging.getLogger(__name__)
+
+
+def percentile(timings, q):
+    timings = sorted(timings)
+    return timings[min(int(q * len(timings)), len(timings) - 1)]
+
+
+@tagged('post_install', '-at_install', '-standard', 'pos_sms_receipt_benchmark')
+class TestSmsReceiptBenchmark(SmsReceiptCommon):
+    """Throughput and latency of the SMS receipt pipeline against the mock gateway.
+
+    Not part of the standard test run, start it with::
+
+        odoo-bin -d <db> -i <module> --test-tags pos_sms_receipt_benchmark --stop-after-init
+
+    Results are logged; the query budgets guarding against regressions are
+    in ``test_sms_receipt_performance``.
+    """
+
+    def test_render_throughput_by_basket_size(self):
+        for items in (1, 10, 50):
+            orders = self.create_orders(20, items=items)
+            self.env.invalidate_all()
+            start = time.perf_counter()
+            for order in orders:
+                order._render_custom_sms_receipt()
+            single = time.perf_counter() - start
+
+            self.env.invalidate_all()
+            start = time.perf_counter()
+            orders._render_sms_receipts()
+            batched = time.perf_counter() - start
+            _logger.info(
+                "SMS receipt render, %s items: %.0f receipts/s one by one, %.0f receipts/s batched",
+                items, len(orders) / single, len(orders) / batched
+            )
+
+    def test_send_latency(self):
+        self.gateway.latency = 0.005
+        orders = self.create_orders(30)
+        timings = []
+        for index, order in enumerate(orders):
+            start = time.perf_counter()
+            result = order.action_send_sms_receipt('2000%04d' % index)
+            timings.append(time.perf_counter() - start)
+            self.assertIs(result, True)
+        self.assertEqual(self.gateway.calls, len(orders))
+        _logger.info(
+            "action_send_sms_receipt latency: p50 %.1f ms, p95 %.1f ms, p99 %.1f ms",
+            percentile(timings, 0.5) * 1000, percentile(timings, 0.95) * 1000, percentile(timings, 0.99) * 1000
+        )
+
+    def test_concurrent_tills_throughput(self):
+        """Tills flush their outboxes in turn, like the batched RPC of the POS does.
+
+        Test transactions cannot run in parallel, so concurrency is simulated
+        by interleaving the flushes of the tills.
+        """
+        self.gateway.latency = 0.005
+        tills, flushes, batch_size = 5, 4, 10
+        outboxes = []
+        for till in range(tills):
+            orders = self.create_orders(flushes * batch_size)
+            outboxes.append([{
+                'reference': order.pos_reference,
+                'phone': '3%d%06d' % (till, index),
+            } for index, order in enumerate(orders)])
+
+        start = time.perf_counter()
+        for flush in range(flushes):
+            for outbox in outboxes:
+                entries = outbox[flush * batch_size:(flush + 1) * batch_size]
+                results = self.env['pos.order'].send_sms_receipts_from_ui(entries)
+                self.assertTrue(all(result['status'] == 'sent' for result in results.values()))
+        elapsed = time.perf_counter() - start
+
+        receipts = tills * flushes * batch_size
+        self.assertEqual(len(self.gateway.messages), receipts)
+        self.assertEqual(self.gateway.calls, tills * flushes)
+        _logger.info(
+            "%s tills, %s receipts in batches of %s: %.0f receipts/s",
+            tills, receipts, batch_size, receipts / elapsed
+        )
+
+    def test_bulk_send_throughput(self):
+        self.gateway.latency = 0.005
+        orders = self.create_orders(100, phone='40000000')
+        start = time.perf_counter()
+        orders.action_send_sms_receipts_bulk()
+        elapsed = time.perf_counter() - start
+        self.assertTrue(all(orders.mapped('is_sms_receipt_sent')))
+        _logger.info("Bulk send of %s receipts: %.0f receipts/s", len(orders), len(orders) / elapsed)
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+import copy
+from datetime import timedelta
+import re
+from unittest.mock import patch
+
+from psycopg2.errors import UniqueViolation
+
+from odoo import fields
+from odoo.tests import tagged
+from odoo.tools import mute_logger
+
+from .common import SmsReceiptCommon
+from ..models import pos_order
+from ..tools.metrics import dispatch_metrics
+
+
+@tagged('post_install', '-at_install')
+class TestSmsReceiptDispatch(SmsReceiptCommon):
+    """Receipt status, retention and export of the SMS receipt dispatch log."""
+
+    def test_receipt_status(self):
+        orders = self.create_orders(3, phone='12345678')
+        self.gateway.failing_numbers.add('+4512345679')
+        failing = self.create_orders(1, phone='12345679')
+        (orders | failing).action_send_sms_receipts_bulk()
+        self.assertEqual(set(orders.mapped('sms_receipt_state')), {'sent'})
+        self.assertTrue(all(orders.mapped('sms_receipt_sent_at')))
+        self.assertEqual(failing.sms_receipt_state, 'failed')
+
+    def test_send_receipt_does_not_write_orders(self):
+        for delivery_mode in ('full', 'link'):
+            with self.subTest(delivery_mode=delivery_mode):
+                self.template.delivery_mode = delivery_mode
+                order = self.create_orders(1)
+                self.env.flush_all()
+                # The status is read from the dispatch log and the link token
+                # exists from the creation, the order row is not locked
+                with patch.object(self.registry['pos.order'], 'write') as write:
+                    self.assertTrue(order.action_send_sms_receipt('12345678'))
+                    self.assertEqual(
+                        order.action_send_sms_receipt('1234'), {'error': 'Invalid phone number format.'}
+                    )
+                    self.env.flush_all()
+                write.assert_not_called()
+                self.assertTrue(order.is_sms_receipt_sent)
+                self.assertEqual(order.sms_receipt_state, 'sent')
+                self.assertEqual(len(order.sms_receipt_dispatch_ids), 2)
+                self.assertEqual(self.env['pos.order'].search([
+                    ('id', '=', order.id), ('sms_receipt_state', '=', 'sent'),
+                ]), order)
+
+    def test_receipt_link_valid_from_the_last_sending(self):
+        self.template.write({'delivery_mode': 'link', 'link_validity_days': 10})
+        orders = self.create_orders(2)
+        self.assertNotEqual(orders[0].sms_receipt_token, orders[1].sms_receipt_token)
+        Order = self.env['pos.order']
+        token = orders[0].sms_receipt_token
+        # Not sent yet
+        self.assertFalse(Order._get_order_by_sms_receipt_token(token))
+
+        orders[0].action_send_sms_receipt('12345678')
+        self.assertIn(token, orders[0].sms_receipt_dispatch_ids.sms_id.body)
+        self.assertEqual(Order._get_order_by_sms_receipt_token(token), orders[0])
+
+        # Expired 10 days after the sending, until the receipt is sent again
+        self.env.flush_all()
+        self.env.cr.execute("""
+            UPDATE pos_sms_receipt_dispatch
+               SET create_date = NOW() - INTERVAL '11 days', sent_at = NOW() - INTERVAL '11 days'
+             WHERE order_id = %s
+        """, [orders[0].id])
+        self.env.invalidate_all()
+        self.assertFalse(Order._get_order_by_sms_receipt_token(token))
+        orders[0].action_send_sms_receipt('12345678')
+        self.assertEqual(Order._get_order_by_sms_receipt_token(token), orders[0])
+        self.assertEqual(orders[0].sms_receipt_token, token)
+
+    def test_receipt_link_view_does_not_write_the_order(self):
+        self.template.delivery_mode = 'link'
+        order = self.create_orders(1)
+        order.action_send_sms_receipt('12345678')
+        self.env.flush_all()
+        # The receipt link is public, its views must not lock the order row
+        with patch.object(self.registry['pos.order'], 'write') as write:
+            body, etag = order._get_sms_receipt_web_body()
+            self.assertEqual(order._get_sms_receipt_web_body(), (body, etag))
+            self.env.flush_all()
+            write.assert_not_called()
+        self.assertIn(order.name, body)
+
+    def test_search_sent_at_by_latest_sending(self):
+        orders = self.create_orders(3, phone='12345678')
+        orders[:2].action_send_sms_receipts_bulk()
+        now = fields.Datetime.now()
+        earlier = now - timedelta(days=5)
+        orders[0].sms_receipt_dispatch_ids.sent_at = earlier
+        orders[1].sms_receipt_dispatch_ids.sent_at = earlier - timedelta(days=1)
+        # Resent, and a dispatch that is not sent
+        self.env['pos.sms.receipt.dispatch'].create([
+            {'order_id': orders[0].id, 'phone': '+4512345678', 'state': 'sent', 'sent_at': now},
+            {'order_id': orders[1].id, 'phone': '+4512345678', 'state': 'failed'},
+        ])
+        Order = self.env['pos.order']
+        base = [('id', 'in', orders.ids)]
+        self.assertEqual(orders[0].sms_receipt_sent_at, now)
+        self.assertEqual(Order.search(base + [('sms_receipt_sent_at', '=', False)]), orders[2])
+        self.assertEqual(Order.search(base + [('sms_receipt_sent_at', '!=', False)]), orders[:2])
+        self.assertEqual(Order.search(base + [('sms_receipt_sent_at', '=', earlier)]), Order)
+        self.assertEqual(Order.search(base + [('sms_receipt_sent_at', '=', now)]), orders[0])
+        self.assertEqual(Order.search(base + [('sms_receipt_sent_at', '!=', now)]), orders[1:])
+        self.assertEqual(Order.search(base + [('sms_receipt_sent_at', '<', now)]), orders[1])
+        self.assertEqual(Order.search(base + [('sms_receipt_sent_at', '>=', now)]), orders[0])
+
+    def test_customer_phone_read_when_sending(self):
+        partner = self.env['res.partner'].create({'name': 'SMS Customer', 'mobile': '12345678'})
+        created = self.env['pos.order'].create_from_ui([
+            self.create_ui_order_data([(self.sms_products[0], 1)], customer=partner)
+        ])
+        order = self.env['pos.order'].browse(created[0]['id'])
+        self.assertFalse(order.sms_phone_e164)
+        # Editing the customer leaves their orders alone
+        partner.mobile = '87654321'
+        self.assertFalse(self.env.records_to_compute(order._fields['sms_phone_e164']))
+        order.action_send_sms_receipts_bulk()
+        self.assertEqual(order.sms_receipt_dispatch_ids.phone, '+4587654321')
+
+    def test_retention_in_bounded_batches(self):
+        Dispatch = self.env['pos.sms.receipt.dispatch']
+        old = self.create_orders(5, phone='12345678')
+        old.action_send_sms_receipts_bulk()
+        # Gateway errors may quote the number
+        Dispatch._log_rejected([{
+            'order_id': old[0].id,
+            'phone': '+45 87 65 43 21',
+            'error': "Gateway rejected +4587654321",
+        }])
+        recent = self.create_orders(1, phone='12345678')
+        recent.action_send_sms_receipts_bulk()
+        self.env.flush_all()
+        # Age everything created before the recent order, ids grow with time
+        self.env.cr.execute(
+            "UPDATE pos_order SET create_date = NOW() - INTERVAL '100 days' WHERE id < %s", [recent.id]
+        )
+        self.env.cr.execute(
+            "UPDATE pos_sms_receipt_dispatch SET create_date = NOW() - INTERVAL '100 days' WHERE id < %s",
+            [recent.sms_receipt_dispatch_ids.id]
+        )
+        self.env.invalidate_all()
+
+        Dispatch._cron_apply_retention(batch_size=2)
+        self.assertEqual(set(old.mapped('phone_for_sms_receipt')), {'******78'})
+        self.assertEqual(set(old.sms_receipt_dispatch_ids.mapped('phone')), {'+********78'})
+        self.assertFalse(old.sms_receipt_dispatch_ids.sms_id)
+        # The phones appear nowhere on the redacted dispatches
+        for values in old.sms_receipt_dispatch_ids.read():
+            for value in values.values():
+                self.assertNotIn('345678', str(value))
+                self.assertNotIn('876543', str(value))
+                self.assertNotIn('87 65 43', str(value))
+        self.assertEqual(recent.phone_for_sms_receipt, '12345678')
+        self.assertEqual(recent.sms_receipt_dispatch_ids.phone, '+4512345678')
+
+        self.env['ir.config_parameter'].sudo().set_param('pos_sms_receipt.retention_days', 30)
+        Dispatch._cron_apply_retention(batch_size=2)
+        self.assertFalse(old.sms_receipt_dispatch_ids)
+        self.assertTrue(recent.sms_receipt_dispatch_ids)
+
+    def test_export_rows_in_batches(self):
+        orders = self.create_orders(5, phone='12345678')
+        orders.action_send_sms_receipts_bulk()
+        dispatches = orders.sms_receipt_dispatch_ids
+        domain = [('id', 'in', dispatches.ids), ('state', '=', 'sent')]
+        rows = list(self.env['pos.sms.receipt.dispatch']._export_rows(domain, batch_size=2))
+        self.assertEqual([row['order'] for row in rows], dispatches.sorted('id').order_id.mapped('name'))
+        self.assertEqual({row['phone'] for row in rows}, {'+4512345678'})
+        self.assertTrue(all(row['body'] for row in rows))
+
+    def test_bulk_send_reports_retries_as_queued(self):
+        sent = self.create_orders(1, phone='12345678')
+        sent.action_send_sms_receipts_bulk()
+        orders = self.create_orders(2, phone='12345678')
+        self.gateway.down = True
+        action = (sent | orders).action_send_sms_receipts_bulk()
+        self.assertEqual(set(orders.sms_receipt_dispatch_ids.mapped('state')), {'retry'})
+        self.assertEqual(action['params']['message'], "0 sent, 2 queued, 1 skipped, 0 failed")
+
+    def test_dedup_key_held_by_one_live_dispatch(self):
+        order = self.create_orders(1, phone='12345678')
+        self.assertTrue(order.action_send_sms_receipt())
+        first = order.sms_receipt_dispatch_ids
+        # An identical request that missed the first one cannot create a second dispatch
+        with self.assertRaises(UniqueViolation), mute_logger('odoo.sql_db'), self.env.cr.savepoint():
+            self.env['pos.sms.receipt.dispatch'].create({
+                'order_id': order.id,
+                'phone': first.phone,
+                'dedup_key': first.dedup_key,
+            })
+        self.assertTrue(order.action_send_sms_receipt())
+        self.assertEqual(order.sms_receipt_dispatch_ids, first)
+        # A request racing the first one, which it does not see, returns it
+        Dispatch = self.env['pos.sms.receipt.dispatch']
+        with patch.object(self.registry['pos.sms.receipt.dispatch'], 'search', return_value=Dispatch), \
+                mute_logger('odoo.sql_db'):
+            self.assertTrue(order.action_send_sms_receipt())
+        self.assertEqual(order.sms_receipt_dispatch_ids, first)
+        self.assertEqual(self.gateway.calls, 1)
+        # Past the deduplication window, a new dispatch takes the key over
+        self.config.sms_dedup_window = 0
+        self.assertTrue(order.action_send_sms_receipt())
+        self.assertEqual(len(order.sms_receipt_dispatch_ids), 2)
+        self.assertFalse(first.dedup_key)
+        self.assertEqual(self.gateway.calls, 2)
+
+    def test_circuit_breaker_queues_the_rest_of_a_send(self):
+        self.config.sms_circuit_threshold = 2
+        orders = self.create_orders(5, phone='12345678')
+        self.env['pos.sms.receipt.dispatch']._dispatch_receipts([
+            {'order_id': order.id, 'phone': '+4512345678'} for order in orders
+        ], immediate=False)
+        dispatches = orders.sms_receipt_dispatch_ids.sorted('id')
+        self.gateway.down = True
+        dispatches._send(chunk_size=1)
+        # The circuit opened after two failed gateway calls, the other chunks were not tried
+        self.assertEqual(self.gateway.calls, 2)
+        self.assertEqual(dispatches[:2].mapped('state'), ['retry', 'retry'])
+        held = dispatches[2:]
+        self.assertEqual(set(held.mapped('state')), {'queued'})
+        self.assertTrue(all(held.mapped('next_attempt')))
+        self.assertFalse(held.sms_id)
+        state = self.env['pos.sms.gateway.state'].search([('gateway_id', '=', dispatches[0].gateway_id.id)])
+        self.assertEqual(state.circuit_state, 'open')
+
+        # After the cooldown, a trial send closes the circuit and the others follow
+        self.gateway.down = False
+        state.opened_at = fields.Datetime.now() - timedelta(minutes=10)
+        self.env.flush_all()
+        held._send(chunk_size=1)
+        self.assertEqual(set(held.mapped('state')), {'sent'})
+        self.assertEqual(self.gateway.calls, 5)
+        state.invalidate_recordset()
+        self.assertEqual(state.circuit_state, 'closed')
+
+    def test_rate_limiter_queues_receipts_over_the_limit(self):
+        self.config.sms_rate_limit = 2
+        orders = self.create_orders(5, phone='12345678')
+        action = orders.action_send_sms_receipts_bulk()
+        dispatches = orders.sms_receipt_dispatch_ids
+        self.assertEqual(dispatches.mapped('state').count('sent'), 2)
+        held = dispatches.filtered(lambda d: d.state == 'queued')
+        self.assertEqual(len(held), 3)
+        self.assertTrue(all(attempt > fields.Datetime.now() for attempt in held.mapped('next_attempt')))
+        self.assertEqual(self.gateway.calls, 1)
+        self.assertEqual(action['params']['message'], "2 sent, 3 queued, 0 skipped, 0 failed")
+
+    def test_metrics_shared_by_workers(self):
+        Metric = self.env['pos.sms.receipt.metric']
+        dispatch_metrics.drain()
+        orders = self.create_orders(2, phone='12345678')
+        orders.action_send_sms_receipts_bulk()
+        # Counted by the worker, stored once the transaction is committed
+        Metric._flush()
+        sent = r'pos_sms_receipt_sent_total\{gateway="[^"]*",pos="%s"\} %s'
+        metrics = Metric._render_prometheus()
+        self.assertRegex(metrics, sent % (re.escape(self.config.name), r'2\.0'))
+        self.assertIn('pos_sms_receipt_stage_seconds_count{stage="total"} 1.0', metrics)
+        self.assertIn('pos_sms_receipt_stage_seconds_bucket{stage="total",le="+Inf"} 1.0', metrics)
+        # The counts of another worker add up
+        gateway = orders.sms_receipt_dispatch_ids[0].gateway_id.name or 'default'
+        dispatch_metrics.inc('sent_total', 3, gateway=gateway, pos=self.config.name)
+        Metric._flush()
+        self.assertRegex(Metric._render_prometheus(), sent % (re.escape(self.config.name), r'5\.0'))
+
+    def test_auto_send_does_not_fail_the_sync(self):
+        self.config.sms_auto_send = True
+        with patch.object(self.registry['pos.sms.receipt.dispatch'], '_enqueue', side_effect=Exception("boom")), \
+                mute_logger(pos_order.__name__):
+            order = self.create_orders(1, phone='12345678')
+        # The order is synced, only its receipt is not queued
+        self.assertTrue(order.exists())
+        self.assertFalse(order.sms_receipt_dispatch_ids)
+
+    def test_send_returns_the_receipt_queued_by_the_sync(self):
+        self.config.sms_auto_send = True
+        order = self.create_orders(1, phone='12345678')
+        queued = order.sms_receipt_dispatch_ids
+        self.assertEqual(order.action_send_sms_receipt(), {'queued': True, 'dispatch_id': queued.id})
+        self.assertEqual(order.sms_receipt_dispatch_ids, queued)
+        self.assertEqual(self.gateway.calls, 0)
+
+    def test_sync_twice_creates_one_order_and_one_dispatch(self):
+        self.config.sms_dispatch_mode = 'queued'
+        Order = self.env['pos.order']
+        ui_order = self.create_ui_order_data([(self.sms_products[0], 1)])
+        reference = ui_order['data']['name']
+        entries = [{'reference': reference, 'phone': '12345678', 'order': ui_order}]
+        first = Order.send_sms_receipts_from_ui(copy.deepcopy(entries))[reference]
+        # The POS flushes its outbox again, e.g. after a timeout
+        second = Order.send_sms_receipts_from_ui(copy.deepcopy(entries))[reference]
+        order = Order.search([('pos_reference', '=', reference)])
+        self.assertEqual(len(order), 1)
+        self.assertEqual(len(order.sms_receipt_dispatch_ids), 1)
+        self.assertEqual(first['status'], 'queued')
+        self.assertEqual(second, first)
+        self.assertEqual(second['dispatch_id'], order.sms_receipt_dispatch_ids.id)
+
+        # Through the single call syncing and sending too
+        results = Order.create_from_ui_with_sms([copy.deepcopy(ui_order)], phone_number='12345678')
+        self.assertEqual(results, [{
+            'id': order.id, 'pos_reference': reference, 'sms_status': 'queued', 'sms_error': False,
+        }])
+        self.assertEqual(Order.search_count([('pos_reference', '=', reference)]), 1)
+        self.assertEqual(len(order.sms_receipt_dispatch_ids), 1)
+        self.assertEqual(self.gateway.calls, 0)
+
+    def test_tax_breakdown_by_rate(self):
+        product7 = self.create_product('SMS Product 7%', self.categ_basic, 107.0, tax_ids=self.taxes['tax7'].ids)
+        product10 = self.create_product('SMS Product 10%', self.categ_basic, 110.0, tax_ids=self.taxes['tax10'].ids)
+        created = self.env['pos.order'].create_from_ui([self.create_ui_order_data([(product7, 1), (product10, 2)])])
+        order = self.env['pos.order'].browse(created[0]['id'])
+        tax_lines = order._get_sms_receipt_tax_lines()[order.id]
+        self.assertEqual([line['tax_rate'] for line in tax_lines], ['10%', '7%'])
+        self.assertAlmostEqual(sum(float(line['tax_amount']) for line in tax_lines), order.amount_tax, places=2)
+        self.assertAlmostEqual(sum(float(line['total']) for line in tax_lines), order.amount_total, places=2)
+
+    def test_tax_breakdown_of_line_with_two_taxes(self):
+        taxes = self.taxes['tax7'] | self.taxes['tax10']
+        product = self.create_product('SMS Product 7% + 10%', self.categ_basic, 100.0, tax_ids=taxes.ids)
+        created = self.env['pos.order'].create_from_ui([self.create_ui_order_data([(product, 2)])])
+        order = self.env['pos.order'].browse(created[0]['id'])
+        tax_lines = order._get_sms_receipt_tax_lines()[order.id]
+        self.assertEqual([line['tax_rate'] for line in tax_lines], ['10%', '7%'])
+        # Each tax only counts its own share of the line
+        self.assertAlmostEqual(sum(float(line['tax_amount']) for line in tax_lines), order.amount_tax, places=2)
+        untaxed = f"{order.amount_total - order.amount_tax:.2f}"
+        self.assertEqual([line['tax_base'] for line in tax_lines], [untaxed, untaxed])
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import tagged
+
+from .common import SmsReceiptCommon
+
+# Queries a receipt may add to a bulk send, whatever the batch size
+BULK_QUERIES_PER_RECEIPT = 3
+# Queries of sending one receipt immediately, once the caches are warm:
+# - 2 for the order and its pre-rendered body, which is not prefetched
+# - 6 for the receipt data: the order lines and payments, then the values
+#   of the lines, products, product templates and payments
+# - 4 for the tax breakdown: the line taxes, their values and what
+#   compute_all reads of them
+# - 1 for the deduplication lookup
+# - 3 for the dispatch insert, in a savepoint so a concurrent identical
+#   request can be reused
+# - 1 for the circuit breaker state, read once per transaction
+# - 1 for the SMS record insert
+# - 9 for the SMS gateway call: the SMS record results and the dispatch
+#   status, rendered body and segment count written at the flush
+SEND_RECEIPT_QUERIES = 27
+
+
+@tagged('post_install', '-at_install')
+class TestSmsReceiptPerformance(SmsReceiptCommon):
+    """Query budgets of the SMS receipt pipeline; exceeding them fails the build."""
+
+    def count_queries(self, func):
+        """Count the queries of ``func`` on a cold cache, pending writes included."""
+        self.env.flush_all()
+        self.env.invalidate_all()
+        start = self.env.cr.sql_log_count
+        func()
+        self.env.flush_all()
+        return self.env.cr.sql_log_count - start
+
+    def test_template_resolution_queries(self):
+        Template = self.env['sms.receipt.template']
+        company_id = self.env.company.id
+        self.env.registry.clear_cache()
+        # One grouped query builds the resolution map
+        with self.assertQueryCount(1):
+            Template.get_default_template(company_id=company_id, language='da_DK')
+        # Then every lookup, fallbacks included, is served from the map
+        with self.assertQueryCount(0):
+            Template.get_default_template(company_id=company_id, language='da_DK')
+            Template.get_default_template(company_id=company_id, language='en_US')
+            Template.get_default_template(company_id=company_id, language='nl_NL')
+
+    def test_render_queries_independent_of_order_count(self):
+        few = self.create_orders(2)
+        many = self.create_orders(20)
+        self.assertEqual(
+            self.count_queries(many._render_sms_receipts),
+            self.count_queries(few._render_sms_receipts),
+        )
+
+    def test_render_queries_independent_of_basket_size(self):
+        small = self.create_orders(3, items=1)
+        large = self.create_orders(3, items=50)
+        self.assertEqual(
+            self.count_queries(large._render_sms_receipts),
+            self.count_queries(small._render_sms_receipts),
+        )
+
+    def test_bulk_send_queries_per_receipt(self):
+        few = self.create_orders(5, phone='12345678')
+        many = self.create_orders(25, phone='12345679')
+        few_queries = self.count_queries(few.action_send_sms_receipts_bulk)
+        many_queries = self.count_queries(many.action_send_sms_receipts_bulk)
+        self.assertTrue(all(many.mapped('is_sms_receipt_sent')))
+        self.assertLessEqual(many_queries - few_queries, BULK_QUERIES_PER_RECEIPT * (len(many) - len(few)))
+        # One gateway call per bulk send
+        self.assertEqual(self.gateway.calls, 2)
+
+    def test_send_receipt_query_budget(self):
+        first, order = self.create_orders(2, phone='12345678')
+        # Warm up the template, renderer and gateway state caches
+        first.action_send_sms_receipt()
+        self.env.flush_all()
+        # The circuit breaker state is only kept for the transaction
+        self.env.cr.cache.pop('pos_sms_gateway_state', None)
+        with self.assertQueryCount(SEND_RECEIPT_QUERIES):
+            self.assertTrue(order.action_send_sms_receipt())
+            self.env.flush_all()
+        self.assertTrue(order.is_sms_receipt_sent)
+        self.assertEqual(order.sms_receipt_dispatch_ids.attempt_count, 1)
+
+    def test_send_receipt_queries_independent_of_basket_size(self):
+        warmup = self.create_orders(1, phone='12345678')
+        small = self.create_orders(1, items=1, phone='12345678')
+        large = self.create_orders(1, items=50, phone='12345678')
+        warmup.action_send_sms_receipt()
+        self.assertEqual(
+            self.count_queries(large.action_send_sms_receipt),
+            self.count_queries(small.action_send_sms_receipt),
+        )
+
+    def test_prerendered_receipt_send(self):
+        self.config.sms_prerender = True
+        rendered, prerendered = self.create_orders(2, phone='12345678')
+        # Render the receipts as the post-commit hook of the sync does
+        (rendered | prerendered)._prerender_sms_receipts()
+        self.assertTrue(prerendered.sms_receipt_body)
+        self.assertTrue(prerendered.sms_receipt_segments)
+        rendered.sms_receipt_body = False
+        rendered_queries = self.count_queries(rendered.action_send_sms_receipt)
+        prerendered_queries = self.count_queries(prerendered.action_send_sms_receipt)
+        self.assertLess(prerendered_queries, rendered_queries)
+        self.assertEqual(prerendered.sms_receipt_dispatch_ids.body, prerendered.sms_receipt_body)
+
+    def test_auto_send_queues_synced_orders_in_one_batch(self):
+        self.config.sms_auto_send = True
+        orders = self.create_orders(10, phone='12345678')
+        dispatches = orders.sms_receipt_dispatch_ids
+        self.assertEqual(len(dispatches), 10)
+        self.assertEqual(set(dispatches.mapped('state')), {'queued'})
+        # The sync renders nothing, the queue does
+        self.assertFalse(any(dispatches.mapped('body')))
+        self.assertEqual(self.gateway.calls, 0)
+        # The queue sends the whole sync in one gateway call
+        self.env['pos.sms.receipt.dispatch']._cron_process_queue()
+        self.assertTrue(all(orders.mapped('is_sms_receipt_sent')))
+        self.assertEqual(self.gateway.calls, 1)
+
+    def test_tax_breakdown_queries_independent_of_order_count(self):
+        product7 = self.create_product('SMS Product 7%', self.categ_basic, 107.0, tax_ids=self.taxes['tax7'].ids)
+        product10 = self.create_product('SMS Product 10%', self.categ_basic, 110.0, tax_ids=self.taxes['tax10'].ids)
+        lines = [(product7, 1), (product10, 2)]
+        created = self.env['pos.order'].create_from_ui([self.create_ui_order_data(lines) for _index in range(6)])
+        orders = self.env['pos.order'].browse([order['id'] for order in created])
+        self.assertEqual(
+            self.count_queries(orders._get_sms_receipt_tax_lines),
+            self.count_queries(orders[:1]._get_sms_receipt_tax_lines),
+        )
+
+    def test_reporting_queries(self):
+        orders = self.create_orders(3, phone='12345678')
+        orders.action_send_sms_receipts_bulk()
+        self.env.flush_all()
+        # Reporting aggregates in the database, whatever the number of receipts
+        with self.assertQueryCount(1):
+            self.env['pos.sms.receipt.dispatch']._read_group(
+                [('config_id', '=', self.config.id)], ['state'], ['segments:sum', '__count'],
+            )
+
+    def test_export_queries_per_batch(self):
+        orders = self.create_orders(5, phone='12345678')
+        orders.action_send_sms_receipts_bulk()
+        domain = [('id', 'in', orders.sms_receipt_dispatch_ids.ids), ('state', '=', 'sent')]
+        Dispatch = self.env['pos.sms.receipt.dispatch']
+        # Each batch reads the same number of queries, whatever the rows before
+        one_batch = self.count_queries(lambda: list(Dispatch._export_rows(domain, batch_size=5)))
+        five_batches = self.count_queries(lambda: list(Dispatch._export_rows(domain, batch_size=1)))
+        self.assertLessEqual(five_batches, 5 * one_batch)
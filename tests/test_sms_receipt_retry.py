@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import tagged
+
+from .common import SmsReceiptCommon
+from ..models import pos_sms_receipt_dispatch
+
+
+@tagged('post_install', '-at_install')
+class TestSmsReceiptRetry(SmsReceiptCommon):
+    """Retries of the SMS receipts the gateway failed to send."""
+
+    def send_receipt(self, phone='12345678'):
+        order = self.create_orders(1)
+        order.action_send_sms_receipt(phone)
+        return order.sms_receipt_dispatch_ids
+
+    def run_due_retries(self, dispatches):
+        dispatches.next_attempt = fields.Datetime.now() - timedelta(seconds=1)
+        self.env['pos.sms.receipt.dispatch']._cron_process_retries()
+
+    def test_retry_delay_doubles_up_to_six_hours(self):
+        Dispatch = self.env['pos.sms.receipt.dispatch']
+        with patch.object(pos_sms_receipt_dispatch.random, 'uniform', return_value=0.0) as uniform:
+            self.assertEqual([Dispatch._get_retry_delay(attempt) for attempt in range(1, 6)], [60, 120, 240, 480, 960])
+            self.assertEqual(Dispatch._get_retry_delay(9), 15360)
+            self.assertEqual(Dispatch._get_retry_delay(10), 6 * 3600)
+            self.assertEqual(Dispatch._get_retry_delay(30), 6 * 3600)
+        uniform.assert_called_with(-0.2, 0.2)
+
+        # The jitter moves the delay by 20% at most
+        with patch.object(pos_sms_receipt_dispatch.random, 'uniform', side_effect=lambda low, high: low):
+            self.assertAlmostEqual(Dispatch._get_retry_delay(1), 48)
+        with patch.object(pos_sms_receipt_dispatch.random, 'uniform', side_effect=lambda low, high: high):
+            self.assertAlmostEqual(Dispatch._get_retry_delay(1), 72)
+            self.assertAlmostEqual(Dispatch._get_retry_delay(30), 6 * 3600 * 1.2)
+        for _index in range(100):
+            self.assertTrue(48 <= Dispatch._get_retry_delay(1) <= 72)
+
+    def test_gateway_error_retried_by_the_cron(self):
+        self.gateway.down = True
+        dispatch = self.send_receipt()
+        self.assertEqual(dispatch.state, 'retry')
+        self.assertEqual(dispatch.attempt_count, 1)
+        self.assertTrue(dispatch.error)
+        self.assertGreater(dispatch.next_attempt, fields.Datetime.now())
+
+        # Not due yet
+        self.env['pos.sms.receipt.dispatch']._cron_process_retries()
+        self.assertEqual(self.gateway.calls, 1)
+
+        self.gateway.down = False
+        self.run_due_retries(dispatch)
+        self.assertEqual(dispatch.state, 'sent')
+        self.assertEqual(dispatch.attempt_count, 2)
+        self.assertFalse(dispatch.error)
+        self.assertFalse(dispatch.next_attempt)
+        self.assertEqual(self.gateway.calls, 2)
+
+    def test_failed_after_max_attempts(self):
+        self.gateway.down = True
+        dispatch = self.send_receipt()
+        self.run_due_retries(dispatch)
+        self.assertEqual(dispatch.state, 'retry')
+        self.assertEqual(dispatch.attempt_count, 2)
+
+        # Third and last attempt of the POS
+        self.run_due_retries(dispatch)
+        self.assertEqual(dispatch.state, 'failed')
+        self.assertEqual(dispatch.attempt_count, 3)
+        self.assertTrue(dispatch.error)
+        self.assertFalse(dispatch.next_attempt)
+        self.assertEqual(self.gateway.calls, 3)
+
+        self.env['pos.sms.receipt.dispatch']._cron_process_retries()
+        self.assertEqual(self.gateway.calls, 3)
+
+    def test_invalid_number_fails_at_once(self):
+        # Rejected by the gateway
+        self.gateway.failing_numbers.add('+4512345679')
+        dispatch = self.send_receipt('12345679')
+        self.assertEqual(dispatch.state, 'failed')
+        self.assertEqual(dispatch.attempt_count, 1)
+        self.assertFalse(dispatch.next_attempt)
+        self.assertEqual(self.gateway.calls, 1)
+
+        # Rejected before sending
+        dispatch = self.send_receipt('1234')
+        self.assertEqual(dispatch.state, 'failed')
+        self.assertFalse(dispatch.next_attempt)
+        self.assertEqual(self.gateway.calls, 1)
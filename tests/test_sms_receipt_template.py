@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from odoo.exceptions import ValidationError
+from odoo.tests import tagged
+
+from .common import SmsReceiptCommon
+
+
+@tagged('post_install', '-at_install')
+class TestSmsReceiptTemplate(SmsReceiptCommon):
+    """Templates are validated when saved and previewed with the sending renderer."""
+
+    def test_unknown_variable_rejected_on_save(self):
+        with self.assertRaises(ValidationError):
+            self.template.total_template = "TOTAL {totl}"
+
+    def test_lookup_and_numeric_spec_rejected_on_save(self):
+        with self.assertRaises(ValidationError):
+            self.template.customer_template = "{customer_name.__class__}"
+        with self.assertRaises(ValidationError):
+            self.template.tax_line_template = "{tax_amount:.2f}"
+        with self.assertRaises(ValidationError):
+            self.template.total_template = "{total!x}"
+
+    def test_preview_uses_sending_renderer(self):
+        self.template.write({
+            'total_template': "TOTAL {total:>8}",
+            'sms_segment_budget': 0,
+        })
+        self.assertIn("TOTAL    75.00", self.template.preview_text)
+        order = self.create_orders(1)
+        body = order._render_custom_sms_receipt()
+        self.assertIn("TOTAL %8s" % f"{order.amount_total:.2f}", body)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from odoo.tests.common import BaseCase
+
+from ..tools.phone_numbers import normalize_e164, redact_phone
+from ..tools.receipt_renderer import ReceiptRenderer
+from ..tools.sms_segments import ReceiptCompactor, is_gsm7, segment_count
+
+
+class TestPhoneNumbers(BaseCase):
+    """Phone number normalization and redaction, no database involved."""
+
+    def test_normalize_international(self):
+        self.assertEqual(normalize_e164('+4512345678'), '+4512345678')
+        self.assertEqual(normalize_e164('+45 12 34 56 78'), '+4512345678')
+        self.assertEqual(normalize_e164('(+45) 12.34/56-78'), '+4512345678')
+        # The '00' international prefix, whatever the default region
+        self.assertEqual(normalize_e164('0045 12345678'), '+4512345678')
+        self.assertEqual(normalize_e164('0031612345678', 45), '+31612345678')
+
+    def test_normalize_national(self):
+        self.assertEqual(normalize_e164('12345678', 45), '+4512345678')
+        self.assertEqual(normalize_e164('12 34 56 78', '45'), '+4512345678')
+        # The trunk prefix is dropped
+        self.assertEqual(normalize_e164('0612345678', 31), '+31612345678')
+        # Without a country, a national number cannot be made E.164
+        self.assertFalse(normalize_e164('12345678'))
+        self.assertFalse(normalize_e164('12345678', None))
+
+    def test_normalize_rejects_junk(self):
+        for phone in (None, False, '', 'abc', '12ab5678', '++4512345678', '+4512', '+0123456789',
+                      '1234567890123456', '+'):
+            with self.subTest(phone=phone):
+                self.assertFalse(normalize_e164(phone, 45))
+
+    def test_redact_phone(self):
+        self.assertEqual(redact_phone('+4512345678'), '+********78')
+        self.assertEqual(redact_phone('12 34 56 78'), '** ** ** 78')
+        self.assertEqual(redact_phone('+4512345678', visible_digits=4), '+******5678')
+        # Too short to hide anything, or empty
+        self.assertEqual(redact_phone('12'), '12')
+        self.assertEqual(redact_phone(''), '')
+        self.assertFalse(redact_phone(False))
+        # Already redacted
+        self.assertEqual(redact_phone('+********78'), '+********78')
+
+
+class TestSmsSegments(BaseCase):
+    """SMS encoding detection and segment counting."""
+
+    def test_encoding(self):
+        # The Danish letters are part of GSM-7
+        self.assertTrue(is_gsm7("Tak for dit køb hos Æbleø Bageri, Århus"))
+        self.assertEqual(segment_count("Tak for dit køb")[0], 'gsm7')
+        # Curly quotes and long dashes are not
+        self.assertFalse(is_gsm7("Tak for dit “køb”"))
+        self.assertEqual(segment_count("Tak for dit “køb”")[0], 'ucs2')
+        self.assertEqual(segment_count("Pris – 10 kr")[0], 'ucs2')
+        self.assertEqual(segment_count(''), ('gsm7', 0))
+
+    def test_gsm7_part_boundaries(self):
+        self.assertEqual(segment_count('a' * 160), ('gsm7', 1))
+        self.assertEqual(segment_count('a' * 161), ('gsm7', 2))
+        self.assertEqual(segment_count('a' * 153 * 2), ('gsm7', 2))
+        self.assertEqual(segment_count('a' * (153 * 2 + 1)), ('gsm7', 3))
+        # Extension characters take two septets
+        self.assertEqual(segment_count('€' * 80), ('gsm7', 1))
+        self.assertEqual(segment_count('€' * 81), ('gsm7', 2))
+
+    def test_ucs2_part_boundaries(self):
+        self.assertEqual(segment_count('“' * 70), ('ucs2', 1))
+        self.assertEqual(segment_count('“' * 71), ('ucs2', 2))
+        self.assertEqual(segment_count('“' * 67 * 2), ('ucs2', 2))
+        self.assertEqual(segment_count('“' * (67 * 2 + 1)), ('ucs2', 3))
+        # Characters outside the basic plane take two code units
+        self.assertEqual(segment_count('\U0001F600' * 35), ('ucs2', 1))
+        self.assertEqual(segment_count('\U0001F600' * 36), ('ucs2', 2))
+
+
+class TestReceiptCompactor(BaseCase):
+    """Each compaction strategy brings a receipt under its segment budget."""
+
+    def setUp(self):
+        super().setUp()
+        self.renderer = ReceiptRenderer({
+            'company_info': '{company_name}\n{phone_line}',
+            'separator': '--------------------------------',
+            'items': '{qty}x {product_name} = {price} kr',
+            'total': 'TOTAL kr {total}',
+            'customer': 'Kunde: {customer_name}',
+            'footer': 'Tak for dit køb!\n{website_line}',
+        })
+
+    def receipt_values(self, items=5, product_name='Vare {index}'):
+        return {
+            'company_info': {'company_name': 'Købmand Østergaard', 'phone_line': 'Tlf: 12 34 56 78'},
+            'separator': {},
+            'items': [
+                {'qty': 1, 'product_name': product_name.format(index=index), 'price': '%s.00' % (10 + index)}
+                for index in range(items)
+            ],
+            'total': {'total': '100.00'},
+            'customer': {'customer_name': 'Jens Hansen'},
+            'footer': {'website_line': 'www.example.dk'},
+        }
+
+    def compact(self, values, **strategies):
+        self.assertGreater(segment_count(self.renderer.render(values))[1], strategies['budget'])
+        return ReceiptCompactor(**strategies).compact(self.renderer, values)
+
+    def test_no_budget(self):
+        values = self.receipt_values()
+        body = ReceiptCompactor(budget=0, truncate_items=True, drop_sections=True).compact(self.renderer, values)
+        self.assertEqual(body, self.renderer.render(values))
+
+    def test_whitespace(self):
+        values = self.receipt_values(items=3, product_name='Vare          {index}')
+        values['separator'] = None
+        values['customer'] = None
+        body = self.compact(values, budget=1, whitespace=True)
+        self.assertEqual(segment_count(body), ('gsm7', 1))
+        self.assertIn('1x Vare 0 = 10.00 kr', body)
+
+    def test_transliteration(self):
+        values = self.receipt_values(items=3, product_name='Brød – “grov” {index}')
+        body = self.compact(values, budget=2, transliterate=True)
+        self.assertEqual(segment_count(body), ('gsm7', 2))
+        # GSM-7 letters are kept
+        self.assertIn('1x Brød - "grov" 0 = 10.00 kr', body)
+        self.assertIn('Købmand Østergaard', body)
+
+    def test_item_truncation(self):
+        values = self.receipt_values(items=30)
+        body = self.compact(values, budget=2, truncate_items=True)
+        self.assertEqual(segment_count(body)[1], 2)
+        lines = body.split('\n')
+        more = [line for line in lines if line.endswith(' more')]
+        self.assertEqual(len(more), 1)
+        kept = [line for line in lines if line.startswith('1x ')]
+        # The first items are kept, the others counted in the last line
+        self.assertTrue(kept)
+        self.assertEqual(kept, ['1x Vare %s = %s.00 kr' % (index, 10 + index) for index in range(len(kept))])
+        self.assertEqual(more[0], '+%s more' % (30 - len(kept)))
+        # Sections are only dropped by their own strategy
+        self.assertIn('Kunde: Jens Hansen', body)
+
+    def test_section_drop_order(self):
+        values = self.receipt_values()
+        body = self.compact(values, budget=1, drop_sections=True)
+        self.assertEqual(segment_count(body)[1], 1)
+        # Separator, customer then company information go first, the footer stays
+        self.assertNotIn('-----', body)
+        self.assertNotIn('Kunde', body)
+        self.assertNotIn('Østergaard', body)
+        self.assertIn('Tak for dit køb!', body)
+        self.assertIn('1x Vare 4 = 14.00 kr', body)
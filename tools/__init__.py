@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+from . import receipt_renderer
+from . import sms_segments
+from . import phone_numbers
+from . import metrics
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""SMS receipt dispatch metrics, exported in the Prometheus text format.
+
+Each process counts in memory what it observes, then hands its counts over
+to shared storage (see ``pos.sms.receipt.metric``) where the counts of all
+the processes add up. Latencies are histograms with fixed buckets, so they
+add up across processes too. This module has no Odoo dependency.
+"""
+from contextlib import contextmanager
+import math
+import threading
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets, from a quick
+# render to a receipt delivered after its last retry
+BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+    60, 300, 900, 3600, 21600, math.inf,
+)
+
+PREFIX = 'pos_sms_receipt'
+
+# name: (type, help)
+METRICS = {
+    'stage_seconds': ('histogram', "Duration of the SMS receipt dispatch stages."),
+    'gateway_seconds': ('histogram', "Duration of the SMS gateway calls, per gateway call."),
+    'delivery_seconds': ('histogram', "Time from the receipt request to its sending."),
+    'sent_total': ('counter', "SMS receipts sent."),
+    'failed_total': ('counter', "SMS receipts given up after their last attempt."),
+    'retries_total': ('counter', "SMS receipt retries scheduled."),
+    'segments_total': ('counter', "SMS segments sent."),
+    'success_ratio': ('gauge', "Sent receipts over sent and failed receipts."),
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, _escape(value)) for key, value in labels)
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == math.inf else repr(float(bound))
+
+
+class MetricsRegistry:
+    """Thread-safe counts of a process, waiting to be handed over to shared storage.
+
+    Every count is a series keyed by (series name, sorted labels); a
+    histogram observation counts in the ``_bucket``, ``_sum`` and ``_count``
+    series of the histogram.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.pending[key] = self.pending.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        labels = tuple(sorted(labels.items()))
+        with self.lock:
+            # Every bucket is counted, so each series exports all of them
+            for bound in self.buckets:
+                key = ('%s_bucket' % name, labels + (('le', _format_bound(bound)),))
+                self.pending[key] = self.pending.get(key, 0) + (seconds <= bound)
+            for key, value in ((('%s_sum' % name, labels), seconds), (('%s_count' % name, labels), 1)):
+                self.pending[key] = self.pending.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of the ``with`` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def drain(self):
+        """Take the counts made since the last drain.
+
+        :return: dict {(series name, labels): value}
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        return pending
+
+    def restore(self, counts):
+        """Put back counts drained but not stored, to be stored with the next ones."""
+        with self.lock:
+            for key, value in counts.items():
+                self.pending[key] = self.pending.get(key, 0) + value
+
+
+def render_prometheus(series):
+    """Export the series in the Prometheus text exposition format.
+
+    :param series: dict {(series name, labels): value}, the counts of all
+                   the processes added up
+    """
+    # Success ratio per gateway and POS, from the sent and failed counters
+    outcomes = {}
+    for (name, labels), value in series.items():
+        if name in ('sent_total', 'failed_total'):
+            outcome = outcomes.setdefault(labels, [0, 0])
+            outcome[name == 'failed_total'] += value
+    series = dict(series)
+    series.update(
+        (('success_ratio', labels), sent / (sent + failed))
+        for labels, (sent, failed) in outcomes.items() if sent + failed
+    )
+
+    def sort_key(item):
+        (name, labels), _value = item
+        # Buckets in the order of their bounds, +Inf last
+        bound = dict(labels).get('le')
+        return name, tuple(pair for pair in labels if pair[0] != 'le'), float(bound) if bound else 0.0
+
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        names = ('%s_bucket' % name, '%s_sum' % name, '%s_count' % name) if metric_type == 'histogram' else (name,)
+        family = sorted((item for item in series.items() if item[0][0] in names), key=sort_key)
+        if not family:
+            continue
+        full_name = '%s_%s' % (PREFIX, name)
+        lines.append('# HELP %s %s' % (full_name, help_text))
+        lines.append('# TYPE %s %s' % (full_name, metric_type))
+        for (series_name, labels), value in family:
+            lines.append('%s_%s%s %s' % (PREFIX, series_name, _format_labels(labels), repr(float(value))))
+    return '\n'.join(lines) + '\n'
+
+
+# Counts of the process, waiting to be stored
+dispatch_metrics = MetricsRegistry()
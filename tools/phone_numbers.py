@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Phone number normalization to E.164.
+
+Numbers are normalized with precompiled patterns, national numbers getting
+the calling code of a default region (e.g. the company country). This module
+has no Odoo dependency.
+"""
+import re
+
+# Separators people type in phone numbers
+_SEPARATORS_RE = re.compile(r'[\s\-\(\)\.\/]')
+# International number with '+' or the '00' international prefix
+_INTERNATIONAL_RE = re.compile(r'^(?:\+|00)(\d+)$')
+# National number, with an optional trunk prefix '0'
+_NATIONAL_RE = re.compile(r'^0?(\d+)$')
+# E.164: '+', country code not starting with 0, at most 15 digits
+_E164_RE = re.compile(r'^\+[1-9]\d{6,14}$')
+# Phone number looking run of digits and separators in a text
+_PHONE_IN_TEXT_RE = re.compile(r'\+?\d[\d\s\-\(\)\.\/]{5,}\d')
+
+
+def normalize_e164(phone, default_calling_code=None):
+    """Normalize a phone number to E.164, e.g. '+4512345678'.
+
+    :param phone: phone number as typed
+    :param default_calling_code: calling code of the default region (e.g. 45),
+                                 used for numbers without international prefix
+    :return: the E.164 number, or False if the number is not valid or is
+             national without ``default_calling_code``
+    """
+    if not phone:
+        return False
+    cleaned = _SEPARATORS_RE.sub('', phone)
+
+    match = _INTERNATIONAL_RE.match(cleaned)
+    if match:
+        number = '+' + match.group(1)
+    else:
+        match = _NATIONAL_RE.match(cleaned)
+        if not match:
+            return False
+        if not default_calling_code:
+            # No region to complete a national number with, it is not E.164
+            return False
+        number = '+%s%s' % (default_calling_code, match.group(1))
+
+    if not _E164_RE.match(number):
+        return False
+    return number
+
+
+def redact_phone(phone, visible_digits=2):
+    """Mask all digits of a phone number but the last ones, e.g. '+*********78'."""
+    if not phone:
+        return phone
+    digits = [index for index, char in enumerate(phone) if char.isdigit()]
+    masked = set(digits[:max(len(digits) - visible_digits, 0)])
+    return ''.join('*' if index in masked else char for index, char in enumerate(phone))
+
+
+def redact_phones_in_text(text, visible_digits=2):
+    """Mask the phone numbers found in a text, e.g. a gateway error message.
+
+    Runs of at least 7 digits, separators included, are taken for phone numbers.
+    """
+    if not text:
+        return text
+
+    def redact(match):
+        number = match.group(0)
+        if sum(char.isdigit() for char in number) < 7:
+            return number
+        return redact_phone(number, visible_digits)
+
+    return _PHONE_IN_TEXT_RE.sub(redact, text)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Compiled SMS receipt renderer.
+
+Each section template of an ``sms.receipt.template`` is compiled once into a
+Python function, so rendering a receipt is only binding order data to those
+functions. Templates may only use the plain variables of their section, no
+attribute or index lookups, and are validated when they are saved. This
+module has no Odoo dependency.
+"""
+from string import Formatter
+
+_FORMATTER = Formatter()
+
+# Conversions of str.format ({value!r}) and the functions applying them
+CONVERSIONS = {'s': 'str', 'r': 'repr', 'a': 'ascii'}
+
+# Section order of the rendered receipt
+SECTIONS = (
+    'company_info',
+    'separator',
+    'order_info',
+    'items',
+    'total',
+    'tax',
+    'customer',
+    'footer',
+)
+
+# Sections where lines left empty by missing data are removed
+STRIP_EMPTY_LINES_SECTIONS = ('company_info', 'order_info', 'footer')
+
+# Sections rendered once per order line
+REPEATED_SECTIONS = ('items',)
+
+# Sections with a line template repeated per value, e.g. per tax rate:
+# {section name: (line template key, variable receiving the rendered lines)}
+LINE_TEMPLATES = {
+    'tax': ('tax_line', 'tax_lines'),
+}
+
+
+# Variables each section template may use; 'tax_line' is the line template
+# of the tax section and 'link_message' the message of the link delivery mode
+SECTION_VARIABLES = {
+    'company_info': ('company_name', 'phone_line', 'vat_line', 'email_line', 'website_line'),
+    'separator': (),
+    'order_info': ('served_by_line', 'order_name', 'order_date'),
+    'items': ('product_name', 'qty', 'price'),
+    'total': ('total', 'payment_method', 'amount', 'change'),
+    'tax': ('tax_lines', 'tax_amount', 'tax_base', 'total'),
+    'tax_line': ('tax_rate', 'tax_name', 'tax_amount', 'tax_base', 'total'),
+    'customer': ('customer_name',),
+    'footer': ('website_line', 'unique_code', 'order_name', 'order_datetime'),
+    'link_message': ('company_name', 'order_name', 'receipt_url'),
+}
+
+
+class TemplateError(ValueError):
+    """A receipt template that cannot be compiled or uses unknown variables."""
+
+
+def parse_template(template):
+    """Split a str.format template into (literal, field, spec, conversion) tuples."""
+    return list(_FORMATTER.parse(template))
+
+
+def compile_template(template):
+    """Compile a str.format template into a function taking a values dict.
+
+    ``{name}`` / ``{name!r:spec}`` placeholders are turned into a generated
+    function, so the template is not parsed again on each call. Nothing
+    but the values is reachable from the template.
+
+    :raise TemplateError: on malformed templates, attribute/index lookups,
+                          nested specs and unknown conversions
+    """
+    try:
+        parsed = parse_template(template)
+    except ValueError as e:
+        raise TemplateError(str(e)) from None
+    parts = []
+    for literal, field, spec, conversion in parsed:
+        if literal:
+            parts.append(repr(literal))
+        if field is None:
+            continue
+        if not field.isidentifier():
+            raise TemplateError("{%s} is not a variable name" % field)
+        if spec and '{' in spec:
+            raise TemplateError("{%s} has a nested format specification" % field)
+        expr = 'v[%r]' % field
+        if conversion:
+            if conversion not in CONVERSIONS:
+                raise TemplateError("{%s} has an unknown conversion !%s" % (field, conversion))
+            expr = '%s(%s)' % (CONVERSIONS[conversion], expr)
+        parts.append('format(%s, %r)' % (expr, spec or ''))
+
+    if not parts:
+        return lambda v: ''
+    if len(parts) == 1:
+        source = 'lambda v: str(%s)' % parts[0]
+    else:
+        source = "lambda v: ''.join((%s,))" % ', '.join(parts)
+    namespace = {'__builtins__': {}, 'format': format, 'str': str, 'repr': repr, 'ascii': ascii}
+    return eval(compile(source, '<sms receipt template>', 'eval'), namespace)
+
+
+def validate_template(template, variables):
+    """Check that the template compiles, uses only ``variables`` and renders.
+
+    :raise TemplateError: naming the faulty placeholder
+    """
+    render = compile_template(template)
+    unknown = sorted({
+        field for _literal, field, _spec, _conversion in parse_template(template)
+        if field and field not in variables
+    })
+    if unknown:
+        raise TemplateError("unknown variable(s) %s, available: %s" % (
+            ', '.join('{%s}' % field for field in unknown),
+            ', '.join('{%s}' % variable for variable in variables) or "none",
+        ))
+    # Values are strings: a numeric format spec fails here, not at send time
+    try:
+        render(dict.fromkeys(variables, ''))
+    except (ValueError, TypeError) as e:
+        raise TemplateError(str(e)) from None
+    return render
+
+
+class CompiledSection:
+    """A receipt section compiled from its template."""
+
+    __slots__ = (
+        'name', 'template', 'fields', 'render_values', 'strip_empty_lines', 'repeat',
+        'lines_field', 'render_line',
+    )
+
+    def __init__(self, name, template, line_template=None):
+        """
+        :param line_template: template of the lines bound to the ``LINE_TEMPLATES``
+                              variable of the section, rendered once per value
+        """
+        self.name = name
+        self.template = template
+        self.fields = frozenset(
+            field for _literal, field, _spec, _conversion in parse_template(template) if field
+        )
+        self.render_values = compile_template(template)
+        self.strip_empty_lines = name in STRIP_EMPTY_LINES_SECTIONS
+        self.repeat = name in REPEATED_SECTIONS
+        self.lines_field = LINE_TEMPLATES[name][1] if name in LINE_TEMPLATES else None
+        self.render_line = compile_template(line_template or '')
+
+    def render(self, values):
+        """Render the section, or each line of a repeated section.
+
+        Lines of a repeated section given as strings are used as is, e.g. the
+        "+N more" line of a compacted item list.
+        """
+        if self.repeat:
+            render_values = self.render_values
+            return '\n'.join([
+                line_values if isinstance(line_values, str) else render_values(line_values)
+                for line_values in values
+            ]).rstrip()
+        lines = values.get(self.lines_field) if self.lines_field else None
+        if isinstance(lines, list):
+            render_line = self.render_line
+            values = dict(values)
+            values[self.lines_field] = '\n'.join([render_line(line_values) for line_values in lines])
+        text = self.render_values(values)
+        if self.strip_empty_lines:
+            text = '\n'.join(line for line in text.split('\n') if line.strip())
+        return text
+
+
+class ReceiptRenderer:
+    """Renders SMS receipt bodies from the enabled sections of a template."""
+
+    __slots__ = ('sections', 'section_names', 'compactor')
+
+    def __init__(self, section_templates, compactor=None):
+        """Compile the enabled sections given as a {section name: template} dict.
+
+        :param compactor: optional ``ReceiptCompactor`` applied by ``render_sms``
+        """
+        self.sections = tuple(
+            CompiledSection(
+                name, section_templates[name],
+                section_templates.get(LINE_TEMPLATES[name][0]) if name in LINE_TEMPLATES else None,
+            )
+            for name in SECTIONS if section_templates.get(name)
+        )
+        self.section_names = frozenset(section.name for section in self.sections)
+        self.compactor = compactor
+
+    def render(self, values):
+        """Render a receipt body from {section name: values} for one order.
+
+        Sections missing from ``values`` are skipped, so the caller decides
+        about optional sections (e.g. no customer on the order).
+        """
+        parts = []
+        for section in self.sections:
+            section_values = values.get(section.name)
+            if section_values is None:
+                continue
+            text = section.render(section_values)
+            if text.strip():
+                parts.append(text)
+        return '\n\n'.join(parts)
+
+    def render_sms(self, values):
+        """Render the SMS body, compacted to the segment budget of the template if any."""
+        if self.compactor is None:
+            return self.render(values)
+        return self.compactor.compact(self, values)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""SMS encoding and segment counting, and receipt compaction to a segment budget.
+
+This module has no Odoo dependency.
+"""
+import re
+import unicodedata
+
+# GSM 03.38 basic character set (includes æøåÆØÅ, so Danish text stays GSM-7)
+GSM7_BASIC = frozenset(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# GSM 03.38 extension table, each character takes two septets
+GSM7_EXTENSION = frozenset("^{}\\[~]|€\f")
+
+GSM7_SINGLE_LENGTH = 160
+GSM7_PART_LENGTH = 153
+UCS2_SINGLE_LENGTH = 70
+UCS2_PART_LENGTH = 67
+
+# Characters outside GSM-7 commonly found in receipts
+TRANSLITERATIONS = {
+    '–': '-', '—': '-', '−': '-',
+    '‘': "'", '’': "'", '‚': "'",
+    '“': '"', '”': '"', '„': '"',
+    '…': '...', ' ': ' ', '•': '*', '·': '*',
+    '×': 'x', '\t': ' ', '`': "'", '´': "'",
+}
+
+# Optional sections dropped, in this order, to meet a segment budget
+DROP_SECTIONS_ORDER = ('separator', 'tax', 'customer', 'company_info', 'footer', 'order_info')
+
+_SPACES_RE = re.compile(r'[ \t]+')
+_TRAILING_SPACES_RE = re.compile(r' +\n')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+
+def is_gsm7(text):
+    """Check if the text can be sent with the GSM-7 encoding."""
+    return all(char in GSM7_BASIC or char in GSM7_EXTENSION for char in text)
+
+
+def segment_count(text):
+    """Count the SMS segments needed to send the text.
+
+    :return: tuple (encoding, segments) with encoding 'gsm7' or 'ucs2'
+    """
+    if not text:
+        return 'gsm7', 0
+    if is_gsm7(text):
+        length = len(text) + sum(1 for char in text if char in GSM7_EXTENSION)
+        single, part = GSM7_SINGLE_LENGTH, GSM7_PART_LENGTH
+        encoding = 'gsm7'
+    else:
+        # Characters outside the basic plane take two UTF-16 code units
+        length = sum(2 if ord(char) > 0xFFFF else 1 for char in text)
+        single, part = UCS2_SINGLE_LENGTH, UCS2_PART_LENGTH
+        encoding = 'ucs2'
+    if length <= single:
+        return encoding, 1
+    return encoding, -(-length // part)
+
+
+def collapse_whitespace(text):
+    """Collapse runs of spaces, trailing spaces and runs of blank lines."""
+    text = _SPACES_RE.sub(' ', text)
+    text = _TRAILING_SPACES_RE.sub('\n', text)
+    return _BLANK_LINES_RE.sub('\n\n', text).strip()
+
+
+def transliterate(text):
+    """Replace characters outside GSM-7 by their closest GSM-7 equivalent."""
+    chars = []
+    for char in text:
+        if char in GSM7_BASIC or char in GSM7_EXTENSION:
+            chars.append(char)
+            continue
+        replacement = TRANSLITERATIONS.get(char)
+        if replacement is None:
+            # Strip accents, e.g. 'á' -> 'a'; drop what cannot be mapped
+            decomposed = unicodedata.normalize('NFKD', char)
+            replacement = ''.join(c for c in decomposed if c in GSM7_BASIC or c in GSM7_EXTENSION)
+        chars.append(replacement)
+    return ''.join(chars)
+
+
+class ReceiptCompactor:
+    """Shrinks rendered receipts to a segment budget with per-template strategies."""
+
+    __slots__ = ('budget', 'whitespace', 'transliterate', 'truncate_items', 'drop_sections', 'more_label')
+
+    def __init__(self, budget=0, whitespace=False, transliterate=False,
+                 truncate_items=False, drop_sections=False, more_label='+%s more'):
+        self.budget = budget
+        self.whitespace = whitespace
+        self.transliterate = transliterate
+        self.truncate_items = truncate_items
+        self.drop_sections = drop_sections
+        self.more_label = more_label
+
+    def _finish(self, body):
+        if self.whitespace:
+            body = collapse_whitespace(body)
+        if self.transliterate:
+            body = transliterate(body)
+        return body
+
+    def _fits(self, body):
+        return segment_count(body)[1] <= self.budget
+
+    def compact(self, renderer, values):
+        """Render the receipt and compact it until it fits the segment budget.
+
+        Whitespace collapsing and transliteration always apply when enabled.
+        Then, while over budget, the item list is truncated with a "+N more"
+        line and optional sections are dropped. The smallest body reached is
+        returned even if it still exceeds the budget.
+        """
+        body = self._finish(renderer.render(values))
+        if not self.budget or self._fits(body):
+            return body
+
+        values = dict(values)
+        items = values.get('items')
+        if self.truncate_items and items and 'items' in renderer.section_names:
+            body = self._truncate_items(renderer, values, items)
+            if self._fits(body):
+                return body
+
+        if self.drop_sections:
+            for section in DROP_SECTIONS_ORDER:
+                if values.pop(section, None) is not None:
+                    body = self._finish(renderer.render(values))
+                    if self._fits(body):
+                        break
+        return body
+
+    def _truncate_items(self, renderer, values, items):
+        """Keep the most items fitting the budget, updating ``values`` in place."""
+        def render_with(kept):
+            values['items'] = items[:kept] + [self.more_label % (len(items) - kept)]
+            return self._finish(renderer.render(values))
+
+        # Binary search on the number of kept items, the body grows with it
+        low, high = 0, len(items) - 1
+        best = render_with(0)
+        best_kept = 0
+        while low <= high:
+            middle = (low + high) // 2
+            body = render_with(middle)
+            if self._fits(body):
+                best, best_kept = body, middle
+                low = middle + 1
+            else:
+                high = middle - 1
+        values['items'] = items[:best_kept] + [self.more_label % (len(items) - best_kept)]
+        return best